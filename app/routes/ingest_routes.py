@@ -1,7 +1,18 @@
-from fastapi import APIRouter, HTTPException, Request, status
+import asyncio
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
 from app.schema.packet_schema import PacketSchema
+from app.services.batch_ingest_service import (
+    NDJSON_MEDIA_TYPES,
+    BatchVerdicts,
+    array_chunks,
+    ndjson_chunks,
+    validate_array,
+    wire_records,
+)
 from app.services.dpi_engine import DPIEngine
 
 
@@ -22,6 +33,13 @@ class PacketValidationError(Exception):
         super().__init__(self.message)
 
 
+# Seconds between credit top-ups while a WebSocket client is idle or stalled
+CREDIT_POLL_INTERVAL = 0.05
+
+# WebSocket close code for a client that sends beyond its credit
+WS_POLICY_VIOLATION = 1008
+
+
 # Standardized error response helper
 def error_response(status_code: int, error: str, message: str, detail=None) -> JSONResponse:
     content = {
@@ -119,8 +137,170 @@ def create_router(engine: DPIEngine) -> APIRouter:
                 },
             )
 
+    @router.post(
+        "/ingest/batch",
+        status_code=status.HTTP_200_OK,
+        responses={
+            400: {"description": "Malformed batch body"},
+            503: {"description": "DPI engine unavailable"},
+        },
+    )
+    async def ingest_batch(request: Request, verdicts: Literal["rle", "bitmap"] = "rle"):
+        """
+        Ingest many packets in one request.
+
+        The body is either a JSON array of packets or, with
+        `Content-Type: application/x-ndjson`, one packet per line (read
+        and processed as it streams in). Records are validated in bulk
+        and dispatched in chunks; invalid records are skipped and
+        reported by index.
+
+        - rle: `verdicts` is `[[code, count], ...]` in input order, with
+          codes F (forwarded), D (dropped), E (invalid).
+        - bitmap: `verdicts` is base64; bit i (LSB-first) is set when
+          packet i was not forwarded.
+        """
+        if engine is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={
+                    "error": "ServiceUnavailable",
+                    "message": "DPI engine is not available. Please try again later.",
+                },
+            )
+
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        result = BatchVerdicts()
+
+        try:
+            if content_type in NDJSON_MEDIA_TYPES:
+                chunks = ndjson_chunks(request.stream())
+            else:
+                chunks = array_chunks(await request.body())
+
+            async for records in chunks:
+                packets = [packet for packet, _ in records if packet is not None]
+                statuses = await engine.ingest_batch(packets) if packets else []
+                result.add(records, statuses)
+
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"error": "InvalidBatch", "message": str(e)},
+            )
+
+        return {
+            "status": "success",
+            "message": "Batch ingested",
+            "data": result.to_dict(verdicts),
+        }
+
+    @router.websocket("/ingest/ws")
+    async def ingest_ws(websocket: WebSocket, verdicts: Literal["rle", "bitmap"] = "rle"):
+        """
+        Streaming ingest over one WebSocket.
+
+        Each client message is a batch: text is a JSON array of packets,
+        binary is concatenated wire frames (layout in packet_codec). The
+        server answers every batch, in order, with
+        `{"type": "verdicts", "seq": n, ...}` in the /ingest/batch format,
+        or `{"type": "error", "seq": n, "message": ...}` when the batch is
+        malformed or could not be processed.
+
+        Flow control is by credit: the server sends
+        `{"type": "credit", "credit": k}` and the client may send k more
+        records. Credit follows free space in the worker queues, so it
+        dries up as they fill. A batch beyond the client's credit closes
+        the socket with code 1008.
+        """
+        await websocket.accept()
+        session = engine.ingest_credits.open()
+        batches: asyncio.Queue = asyncio.Queue()
+        sender = asyncio.create_task(_send_ws_verdicts(websocket, session, batches, verdicts))
+
+        try:
+            seq = 0
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+
+                try:
+                    if message.get("bytes") is not None:
+                        records = wire_records(message["bytes"])
+                    else:
+                        records = validate_array(message["text"].encode())
+                except ValueError as e:
+                    await batches.put((seq, None, str(e)))
+                    seq += 1
+                    continue
+
+                if not session.spend(len(records)):
+                    await websocket.close(WS_POLICY_VIOLATION, "Credit exceeded")
+                    break
+
+                packets = [packet for packet, _ in records if packet is not None]
+                pending = asyncio.create_task(engine.ingest_batch(packets)) if packets else None
+                await batches.put((seq, records, pending))
+                seq += 1
+
+        except WebSocketDisconnect:
+            pass
+
+        finally:
+            await batches.put(None)
+            await sender
+            engine.ingest_credits.close(session)
+
     return router
 
+
+async def _send_ws_verdicts(websocket: WebSocket, session, batches: asyncio.Queue, fmt: str):
+    # The only task that sends, so replies and credit never interleave
+    # mid-message; keeps draining batches after the client goes away.
+    connected = True
+
+    async def send(message: dict):
+        nonlocal connected
+        if not connected:
+            return
+        try:
+            await websocket.send_json(message)
+        except (WebSocketDisconnect, RuntimeError):
+            connected = False
+
+    await send({"type": "credit", "credit": session.grant()})
+
+    while True:
+        try:
+            item = await asyncio.wait_for(batches.get(), CREDIT_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            item = False
+        if item is None:
+            return
+
+        if item:
+            seq, records, pending = item
+            if records is None:
+                await send({"type": "error", "seq": seq, "message": pending})
+            else:
+                try:
+                    statuses = await pending if pending else []
+                except Exception as e:
+                    # The batch failed as a whole; report it and keep serving
+                    session.settle(len(records))
+                    await send({"type": "error", "seq": seq, "message": f"Batch failed: {e}"})
+                else:
+                    result = BatchVerdicts()
+                    result.add(records, statuses)
+                    session.settle(len(records))
+                    await send({"type": "verdicts", "seq": seq, **result.to_dict(fmt)})
+
+        credit = session.grant()
+        if credit:
+            await send({"type": "credit", "credit": credit})
+
+
 def register_exception_handlers(app):
     """Register global exception handlers on the FastAPI app instance."""
 
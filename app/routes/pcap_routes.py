@@ -2,34 +2,45 @@ import os
 import tempfile
 from fastapi import APIRouter, UploadFile, File
 from app.schema.pcap_report_schema import PcapAnalysisReport
+from app.services.dpi_engine import DPIEngine
 from app.services.pcap_processor import PcapProcessor
 
 router = APIRouter(prefix="", tags=["PCAP Analysis"])
 
-pcap_processor = PcapProcessor()
 
-@router.post("/analyze", response_model=PcapAnalysisReport)
-async def analyze_pcap(file: UploadFile = File(...)):
-    """
-    Upload a .pcap file and get a full DPI analysis report.
-    """
+def create_router(engine: DPIEngine) -> APIRouter:
 
-    tmp_file = tempfile.NamedTemporaryFile(suffix=".pcap", delete=False)
-    tmp_path = tmp_file.name
+    # Share the engine's rule snapshot, prefix table and flow exporter
+    pcap_processor = PcapProcessor(
+        classifier=engine.classifier,
+        rule_service=engine.rule_service,
+        flow_exporter=engine.flow_exporter,
+    )
 
-    try:
-        # Stream write (memory safe)
-        while chunk := await file.read(1024 * 1024):
-            tmp_file.write(chunk)
+    @router.post("/analyze", response_model=PcapAnalysisReport)
+    async def analyze_pcap(file: UploadFile = File(...)):
+        """
+        Upload a .pcap file and get a full DPI analysis report.
+        """
 
-        tmp_file.close()
-        await file.close()
+        tmp_file = tempfile.NamedTemporaryFile(suffix=".pcap", delete=False)
+        tmp_path = tmp_file.name
 
-        report = await pcap_processor.analyze(tmp_path)
-        return report
-
-    finally:
         try:
-            os.unlink(tmp_path)  # guaranteed cleanup
-        except Exception:
-            pass
\ No newline at end of file
+            # Stream write (memory safe)
+            while chunk := await file.read(1024 * 1024):
+                tmp_file.write(chunk)
+
+            tmp_file.close()
+            await file.close()
+
+            report = await pcap_processor.analyze(tmp_path)
+            return report
+
+        finally:
+            try:
+                os.unlink(tmp_path)  # guaranteed cleanup
+            except Exception:
+                pass
+
+    return router
\ No newline at end of file
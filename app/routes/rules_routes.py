@@ -1,18 +1,104 @@
-from fastapi import APIRouter
+import json
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from app.services.dpi_engine import DPIEngine
+from app.services.rule_import_service import RULE_TYPES, detect_format
 
 router = APIRouter(prefix="/rules", tags=["Rules"])
 
+# Optional lifetime for temporary blocks
+TTL_QUERY = Query(default=None, ge=1, description="Expire the rule after this many seconds")
+
+
+def block_message(target: str, ttl: Optional[int]) -> dict:
+    if ttl:
+        return {"message": f"{target} blocked for {ttl}s"}
+    return {"message": f"{target} blocked"}
+
+
 def create_router(engine: DPIEngine) -> APIRouter:
 
+    # =================================================
+    # 📦 Bulk Import / Export
+    # =================================================
+
+    @router.post("/bulk", tags=["Rules - Bulk"])
+    async def import_rules(
+        request: Request,
+        mode: Literal["merge", "replace"] = "merge",
+        type: Optional[str] = Query(default=None, description=f"Default rule type: {', '.join(RULE_TYPES)}"),
+    ):
+        """
+        Import a rule list in one atomic ruleset swap. Body format follows
+        the Content-Type: JSON, CSV (type,value) or newline separated text.
+        With mode=replace the imported types replace their current sets.
+        """
+        if type and type.lower() not in RULE_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"error": "InvalidRuleType", "message": f"Unknown rule type '{type}'"},
+            )
+
+        body = await request.body()
+        try:
+            return await engine.import_rules(
+                body.decode("utf-8"),
+                detect_format(content_type=request.headers.get("content-type")),
+                default_type=type,
+                replace=(mode == "replace"),
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"error": "InvalidRuleList", "message": str(e)},
+            )
+
+    # =================================================
+    # 📈 Rule Hit Stats
+    # =================================================
+
+    @router.get("/stats", tags=["Rules - Stats"])
+    async def get_rule_stats(
+        limit: int = Query(default=100, ge=1, le=100000),
+        include_unused: bool = False,
+        order: Literal["desc", "asc"] = "desc",
+    ):
+        """
+        Per-rule hit and byte counters with last-hit time, sorted by hits.
+        include_unused=true&order=asc lists rules that never fired first.
+        """
+        return await engine.get_rule_stats(
+            limit=limit,
+            include_unused=include_unused,
+            ascending=(order == "asc"),
+        )
+
+    @router.get("/export", tags=["Rules - Bulk"])
+    async def export_rules(format: Literal["csv", "ndjson"] = "csv"):
+        """
+        Stream every rule without building the full list in memory.
+        """
+        async def rows():
+            if format == "csv":
+                yield "type,value\n"
+            async for rule_type, value in engine.export_rules():
+                if format == "csv":
+                    yield f"{rule_type},{value}\n"
+                else:
+                    yield json.dumps({"type": rule_type, "value": value}) + "\n"
+
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        return StreamingResponse(rows(), media_type=media_type)
+
     # =================================================
     # 🚫 IP Rules
     # =================================================
 
     @router.post("/ip/{ip}", tags=["Rules - IP"])
-    async def block_ip(ip: str):
-        await engine.block_ip(ip)
-        return {"message": f"{ip} blocked"}
+    async def block_ip(ip: str, ttl: Optional[int] = TTL_QUERY):
+        await engine.block_ip(ip, ttl=ttl)
+        return block_message(ip, ttl)
 
     @router.delete("/ip/{ip}", tags=["Rules - IP"])
     async def unblock_ip(ip: str):
@@ -23,14 +109,44 @@ def create_router(engine: DPIEngine) -> APIRouter:
     async def list_blocked_ips():
         return await engine.get_blocked_ips()
 
+    # =================================================
+    # 🧮 CIDR Rules
+    # =================================================
+
+    @router.post("/cidr/{prefix:path}", tags=["Rules - CIDR"])
+    async def block_cidr(prefix: str, ttl: Optional[int] = TTL_QUERY):
+        try:
+            await engine.block_cidr(prefix, ttl=ttl)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"error": "InvalidPrefix", "message": str(e)},
+            )
+        return block_message(prefix, ttl)
+
+    @router.delete("/cidr/{prefix:path}", tags=["Rules - CIDR"])
+    async def unblock_cidr(prefix: str):
+        try:
+            await engine.unblock_cidr(prefix)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"error": "InvalidPrefix", "message": str(e)},
+            )
+        return {"message": f"{prefix} unblocked"}
+
+    @router.get("/cidr", tags=["Rules - CIDR"])
+    async def list_blocked_cidrs():
+        return await engine.get_blocked_cidrs()
+
     # =================================================
     # 🌐 Domain Rules
     # =================================================
 
     @router.post("/domain/{domain}", tags=["Rules - Domain"])
-    async def block_domain(domain: str):
-        await engine.block_domain(domain)
-        return {"message": f"{domain} blocked"}
+    async def block_domain(domain: str, ttl: Optional[int] = TTL_QUERY):
+        await engine.block_domain(domain, ttl=ttl)
+        return block_message(domain, ttl)
 
     @router.delete("/domain/{domain}", tags=["Rules - Domain"])
     async def unblock_domain(domain: str):
@@ -46,9 +162,9 @@ def create_router(engine: DPIEngine) -> APIRouter:
     # =================================================
 
     @router.post("/app/{app_name}", tags=["Rules - App"])
-    async def block_app(app_name: str):
-        await engine.block_app(app_name)
-        return {"message": f"{app_name} blocked"}
+    async def block_app(app_name: str, ttl: Optional[int] = TTL_QUERY):
+        await engine.block_app(app_name, ttl=ttl)
+        return block_message(app_name, ttl)
 
     @router.delete("/app/{app_name}", tags=["Rules - App"])
     async def unblock_app(app_name: str):
@@ -1,5 +1,8 @@
-from fastapi import APIRouter
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from app.services.dpi_engine import DPIEngine
+from app.services.flow_query_service import FlowFilter
 
 router = APIRouter(prefix="", tags=["Monitoring"])
 
@@ -11,8 +14,50 @@ def create_router(engine: DPIEngine) -> APIRouter:
         return await engine.get_stats()
 
     @router.get("/stats/connections")
-    async def get_active_connections():
-        return await engine.get_active_connections()
+    async def get_active_connections(
+        cursor: Optional[str] = None,
+        limit: int = Query(default=100, ge=1, le=10000),
+        app: Optional[str] = None,
+        state: Optional[str] = None,
+        ip: Optional[str] = None,
+        port: Optional[int] = Query(default=None, ge=0, le=65535),
+        blocked: Optional[bool] = None,
+        sort: Optional[Literal["bytes", "packets"]] = None,
+        format: Literal["json", "ndjson"] = "json",
+    ):
+        """
+        Active flows, filtered server-side.
+
+        - json: one page of `limit` flows plus `next_cursor`; pass it back
+          as `cursor` for the next page. With `sort`, the top `limit`
+          flows by bytes or packets.
+        - ndjson: every matching flow, streamed.
+        """
+        try:
+            flt = FlowFilter.build(app, state, ip, port, blocked)
+            if format == "ndjson":
+                return StreamingResponse(
+                    await engine.stream_connections(flt),
+                    media_type="application/x-ndjson",
+                )
+            return await engine.query_connections(flt, cursor, limit, sort)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={"error": "InvalidConnectionQuery", "message": str(e)},
+            )
+
+    @router.get("/stats/top")
+    async def get_top_talkers(
+        by: Literal["bytes", "packets"] = "bytes",
+        n: int = Query(default=10, ge=1, le=256),
+    ):
+        """
+        Heaviest source IPs, destination IPs, domains and flows, from
+        streaming sketches. Each estimate is an upper bound, high by at
+        most max_error.
+        """
+        return await engine.get_top_talkers(by, n)
 
     @router.get("/stats/apps")
     async def get_app_stats():
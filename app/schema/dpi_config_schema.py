@@ -4,5 +4,30 @@ from pydantic import BaseModel
 class DPIConfig(BaseModel):
     num_workers: int = 4
     queue_size: int = 10000
+    # "async": workers are tasks on the API event loop.
+    # "process": each worker is an OS process fed over shared-memory rings.
+    worker_mode: str = "async"
+    worker_ring_slots: int = 65536
+    # When a worker queue is full: "block", "shed" or "spill"
+    overload_policy: str = "block"
+    spill_capacity: int = 100000
     rules_file: str | None = None
+    rules_file_replace: bool = False
+    app_prefixes_file: str | None = None
+    # Idle-flow timeouts (seconds)
+    tcp_established_timeout: float = 1800.0
+    tcp_transitory_timeout: float = 30.0
+    udp_timeout: float = 60.0
+    dns_timeout: float = 10.0
+    icmp_timeout: float = 30.0
+    tcp_linger_timeout: float = 2.0
+    # Finished-flow export (disabled unless a directory is set)
+    flow_export_dir: str | None = None
+    flow_export_format: str = "binary"
+    flow_export_rotate_mb: int = 64
+    flow_export_rotate_seconds: int = 3600
+    # Binary ingest listener (disabled unless a port is set)
+    binary_ingest_host: str = "127.0.0.1"
+    binary_ingest_port: int | None = None
+    binary_ingest_udp_port: int | None = None
     verbose: bool = False
\ No newline at end of file
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Dict, Optional
+from app.schema.stats_schema import TopTalkersSchema
 
 
 class ConnectionDetail(BaseModel):
@@ -30,9 +31,16 @@ class PcapAnalysisReport(BaseModel):
     # App classification
     app_breakdown: Dict[str, int] = {}
 
-    # Domains found
+    # Domains found: the first 1000 distinct ones seen, sorted by name
     domains_detected: List[str] = []
 
+    # Distinct domains, IPs and flows, overall and per app (HyperLogLog estimates)
+    distinct: Dict[str, int] = {}
+    distinct_per_app: Dict[str, Dict[str, int]] = {}
+
+    # Heaviest endpoints, domains and flows, by "bytes" and "packets"
+    top_talkers: Dict[str, TopTalkersSchema] = {}
+
     # Blocked connections
     blocked_connections: List[ConnectionDetail] = []
 
@@ -1,8 +1,11 @@
 from pydantic import BaseModel
+from datetime import datetime
 from enum import Enum
+from typing import Optional
 
 class BlockType(str, Enum):
     IP = "IP"
+    CIDR = "CIDR"
     APP = "APP"
     DOMAIN = "DOMAIN"
     PORT = "PORT"
@@ -17,4 +20,13 @@ class RuleStatsSchema(BaseModel):
 
 class BlockReasonSchema(BaseModel):
     type: BlockType
-    detail: str
\ No newline at end of file
+    detail: str
+    rule: Optional[str] = None
+
+
+class RuleHitSchema(BaseModel):
+    type: BlockType
+    rule: str
+    hits: int = 0
+    bytes: int = 0
+    last_hit: Optional[datetime] = None
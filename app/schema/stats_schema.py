@@ -18,5 +18,22 @@ class StatsResponse(BaseModel):
 
 class AppStatsResponse(BaseModel):
     app_distribution: Dict[str, int] = Field(default_factory=dict)
+    # Domains of active flows, at most 1000; distinct["domains"] counts all
     unique_domains: List[str] = Field(default_factory=list)
-    active_connections: int = 0
\ No newline at end of file
+    # HyperLogLog estimates (~1.6% error overall, ~3.3% per app)
+    distinct: Dict[str, int] = Field(default_factory=dict)
+    distinct_per_app: Dict[str, Dict[str, int]] = Field(default_factory=dict)
+    active_connections: int = 0
+
+class HeavyHitterSchema(BaseModel):
+    key: str
+    # Upper bound on the true total; the true total is >= estimate - max_error
+    estimate: int
+    max_error: int
+
+
+class TopTalkersSchema(BaseModel):
+    src_ips: List[HeavyHitterSchema] = Field(default_factory=list)
+    dst_ips: List[HeavyHitterSchema] = Field(default_factory=list)
+    domains: List[HeavyHitterSchema] = Field(default_factory=list)
+    flows: List[HeavyHitterSchema] = Field(default_factory=list)
@@ -0,0 +1,251 @@
+import base64
+import json
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from app.schema.packet_schema import PacketSchema
+from app.services.packet_codec import decode_wire_record, split_wire_frames
+
+
+# Records validated and dispatched per step
+INGEST_CHUNK = 1024
+
+# Invalid records reported back in full
+MAX_ERROR_SAMPLES = 20
+
+VERDICT_FORMATS = ("rle", "bitmap")
+
+# Most records a streaming client may have unanswered
+MAX_CREDIT = 4 * INGEST_CHUNK
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+FORWARDED = "F"
+DROPPED = "D"
+INVALID = "E"
+
+_INVALID_WIRE_RECORD = [{"type": "invalid_record", "msg": "Invalid wire record"}]
+
+_packet = TypeAdapter(PacketSchema)
+_packets = TypeAdapter(List[PacketSchema])
+
+# A parsed record: the packet, or None and its validation errors
+Record = Tuple[Optional[PacketSchema], Optional[list]]
+
+
+def _errors(e: ValidationError) -> list:
+    return e.errors(include_url=False, include_context=False, include_input=False)
+
+
+# =================================================
+# Bulk validation
+# =================================================
+
+def validate_array(items: bytes) -> List[Record]:
+    """
+    Validate a JSON array of packets in one pass. If any element is
+    invalid, fall back to per-element validation so the rest still go
+    through.
+    """
+    try:
+        return [(packet, None) for packet in _packets.validate_json(items)]
+    except ValidationError:
+        pass
+
+    try:
+        data = json.loads(items)
+    except ValueError as e:
+        raise ValueError(f"Body is not valid JSON: {e}")
+    if not isinstance(data, list):
+        raise ValueError("Body must be a JSON array of packets")
+
+    records: List[Record] = []
+    for item in data:
+        try:
+            records.append((_packet.validate_python(item), None))
+        except ValidationError as e:
+            records.append((None, _errors(e)))
+    return records
+
+
+def validate_lines(lines: List[bytes]) -> List[Record]:
+    """
+    Validate NDJSON lines as one array; per-line on failure, or when a
+    line held more than one value ("{...},{...}") so records no longer
+    match lines.
+    """
+    try:
+        packets = _packets.validate_json(b"[" + b",".join(lines) + b"]")
+        if len(packets) == len(lines):
+            return [(packet, None) for packet in packets]
+    except ValidationError:
+        pass
+
+    records: List[Record] = []
+    for line in lines:
+        try:
+            records.append((_packet.validate_json(line), None))
+        except ValidationError as e:
+            records.append((None, _errors(e)))
+    return records
+
+
+def wire_records(data: bytes) -> List[Record]:
+    """Records in a message of concatenated wire frames (see packet_codec)."""
+    frames, consumed = split_wire_frames(data) if data else ([], 0)
+    if consumed != len(data):
+        raise ValueError("Message ends in a partial or malformed frame")
+
+    records: List[Record] = []
+    for frame in frames:
+        packet = decode_wire_record(frame)
+        records.append((packet, None) if packet is not None else (None, _INVALID_WIRE_RECORD))
+    return records
+
+
+async def ndjson_chunks(stream: AsyncIterator[bytes]) -> AsyncIterator[List[Record]]:
+    """Validated records from a streamed NDJSON body, INGEST_CHUNK lines at a time."""
+    pending = b""
+    lines: List[bytes] = []
+
+    async for data in stream:
+        pending += data
+        *complete, pending = pending.split(b"\n")
+        for line in complete:
+            if line.strip():
+                lines.append(line)
+        if len(lines) >= INGEST_CHUNK:
+            yield validate_lines(lines)
+            lines = []
+
+    if pending.strip():
+        lines.append(pending)
+    if lines:
+        yield validate_lines(lines)
+
+
+async def array_chunks(body: bytes) -> AsyncIterator[List[Record]]:
+    records = validate_array(body)
+    for start in range(0, len(records), INGEST_CHUNK):
+        yield records[start:start + INGEST_CHUNK]
+
+
+# =================================================
+# Verdicts
+# =================================================
+
+class BatchVerdicts:
+    """
+    Per-packet outcomes of one batch, in input order: one code byte per
+    packet (F forwarded, D dropped, E invalid).
+
+    Reported either run-length encoded, [[code, count], ...], or as a
+    base64 bitmap with bit i (LSB-first) set when packet i was not
+    forwarded.
+    """
+
+    def __init__(self):
+        self.codes = bytearray()
+        self.errors: List[dict] = []
+
+    def add(self, records: List[Record], statuses: List[str]):
+        """`statuses` holds the engine's verdict for each valid record."""
+        results = iter(statuses)
+        for index, (packet, errors) in enumerate(records, start=len(self.codes)):
+            if packet is None:
+                self.codes.append(ord(INVALID))
+                if len(self.errors) < MAX_ERROR_SAMPLES:
+                    self.errors.append({"index": index, "errors": errors})
+            elif next(results) == "forwarded":
+                self.codes.append(ord(FORWARDED))
+            else:
+                self.codes.append(ord(DROPPED))
+
+    def runs(self) -> List[list]:
+        runs: List[list] = []
+        for code in self.codes:
+            if runs and runs[-1][0] == code:
+                runs[-1][1] += 1
+            else:
+                runs.append([code, 1])
+        return [[chr(code), count] for code, count in runs]
+
+    def bitmap(self) -> str:
+        bits = bytearray((len(self.codes) + 7) // 8)
+        forwarded = ord(FORWARDED)
+        for i, code in enumerate(self.codes):
+            if code != forwarded:
+                bits[i >> 3] |= 1 << (i & 7)
+        return base64.b64encode(bits).decode("ascii")
+
+    def to_dict(self, fmt: str = "rle") -> dict:
+        return {
+            "received": len(self.codes),
+            "forwarded": self.codes.count(ord(FORWARDED)),
+            "dropped": self.codes.count(ord(DROPPED)),
+            "invalid": self.codes.count(ord(INVALID)),
+            "format": fmt,
+            "verdicts": self.bitmap() if fmt == "bitmap" else self.runs(),
+            "errors": self.errors,
+        }
+
+
+# =================================================
+# Streaming credit
+# =================================================
+
+class CreditSession:
+    """
+    One streaming client's credit: records it may still send
+    (`available`) and records sent but not yet answered (`outstanding`).
+    """
+
+    def __init__(self, credits: "IngestCredits"):
+        self.credits = credits
+        self.available = 0
+        self.outstanding = 0
+
+    def spend(self, n: int) -> bool:
+        if n > self.available:
+            return False
+        self.available -= n
+        self.outstanding += n
+        return True
+
+    def settle(self, n: int):
+        self.outstanding -= n
+
+    def grant(self) -> int:
+        """Credit to hand out now, given the workers' free queue space."""
+        # Outstanding records already sit in the queues; unspent credit does not
+        extra = max(0, min(
+            MAX_CREDIT - self.outstanding - self.available,
+            self.credits.share() - self.available,
+        ))
+        self.available += extra
+        return extra
+
+
+class IngestCredits:
+    """
+    Credit-based flow control for streaming ingest. The dispatcher's free
+    slots are split evenly between open sessions, so clients slow down
+    as the queues fill instead of losing packets to backpressure. With
+    flows pinned to workers this is a hint: under the "shed" policy a
+    client whose flows all land on one busy worker can still see drops.
+    """
+
+    def __init__(self, free_slots: Callable[[], int]):
+        self.free_slots = free_slots
+        self.sessions = 0
+
+    def open(self) -> CreditSession:
+        self.sessions += 1
+        return CreditSession(self)
+
+    def close(self, session: CreditSession):
+        self.sessions -= 1
+
+    def share(self) -> int:
+        return self.free_slots() // max(1, self.sessions)
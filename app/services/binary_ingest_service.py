@@ -0,0 +1,175 @@
+import asyncio
+import struct
+from typing import Awaitable, Callable, List, Optional, Set
+
+from app.schema.packet_schema import PacketSchema
+from app.services.packet_codec import (
+    WIRE_DROPPED,
+    WIRE_FORWARDED,
+    WIRE_INVALID,
+    decode_wire_record,
+    split_wire_frames,
+)
+
+
+# Bytes read from a connection per step
+READ_SIZE = 65536
+
+# Batches a connection may have in the workers before reading stalls
+MAX_INFLIGHT_BATCHES = 8
+
+# UDP datagrams start with a client-chosen id, echoed in the reply
+_DATAGRAM_ID = struct.Struct("<I")
+
+
+class BinaryIngestServer:
+    """
+    Optional asyncio TCP/UDP listener for wire records (layout in
+    packet_codec), feeding the workers without going through FastAPI.
+
+    TCP: the client streams length-prefixed frames and reads back one
+    verdict byte per record, in order. Everything that arrives in one
+    read becomes one batch; a connection keeps up to
+    MAX_INFLIGHT_BATCHES batches in the workers while it goes on
+    reading, and verdicts are written back as each batch completes.
+
+    UDP: a datagram is a u32 id followed by frames; the reply is the same
+    id followed by one verdict byte per frame.
+    """
+
+    def __init__(
+        self,
+        ingest_batch: Callable[[List[PacketSchema]], Awaitable[List[str]]],
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        udp_port: Optional[int] = None,
+    ):
+        self.ingest_batch = ingest_batch
+        self.host = host
+        self.port = port
+        self.udp_port = udp_port
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._udp: Optional[asyncio.DatagramTransport] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        if self.port is not None and self._server is None:
+            self._server = await asyncio.start_server(self._handle_stream, self.host, self.port)
+        if self.udp_port is not None and self._udp is None:
+            self._udp, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _DatagramIngest(self),
+                local_addr=(self.host, self.udp_port),
+            )
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # Open connections would otherwise keep wait_closed() waiting
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._udp:
+            self._udp.close()
+            self._udp = None
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
+
+    def _track(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _ingest(self, frames: List[bytes]) -> bytes:
+        packets = [decode_wire_record(frame) for frame in frames]
+        valid = [packet for packet in packets if packet is not None]
+        try:
+            statuses = iter(await self.ingest_batch(valid) if valid else ())
+        except Exception:
+            # Keep the reply in step with the records: report them dropped
+            statuses = iter(["dropped"] * len(valid))
+
+        return bytes(
+            WIRE_INVALID if packet is None
+            else WIRE_FORWARDED if next(statuses) == "forwarded"
+            else WIRE_DROPPED
+            for packet in packets
+        )
+
+    # ==============================
+    # TCP
+    # ==============================
+
+    async def _handle_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        batches: asyncio.Queue = asyncio.Queue(maxsize=MAX_INFLIGHT_BATCHES)
+        sender = self._track(self._send_verdicts(batches, writer))
+        buf = bytearray()
+        self._writers.add(writer)
+
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                buf += data
+                while True:
+                    frames, consumed = split_wire_frames(buf)
+                    if not frames:
+                        break
+                    del buf[:consumed]
+                    await batches.put(self._track(self._ingest(frames)))
+        except (ValueError, ConnectionError):
+            # Bad framing or a dropped peer: stop reading, flush what's in flight
+            pass
+        finally:
+            await batches.put(None)
+            try:
+                await sender
+            except asyncio.CancelledError:
+                pass
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _send_verdicts(self, batches: asyncio.Queue, writer: asyncio.StreamWriter):
+        # Keeps consuming after the peer goes away so the reader never blocks
+        connected = True
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                return
+            verdicts = await batch
+            if not connected:
+                continue
+            try:
+                writer.write(verdicts)
+                await writer.drain()
+            except ConnectionError:
+                connected = False
+
+
+class _DatagramIngest(asyncio.DatagramProtocol):
+
+    def __init__(self, server: BinaryIngestServer):
+        self.server = server
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < _DATAGRAM_ID.size:
+            return
+        try:
+            frames, _ = split_wire_frames(memoryview(data)[_DATAGRAM_ID.size:])
+        except ValueError:
+            return
+        self.server._track(self._reply(data[:_DATAGRAM_ID.size], frames, addr))
+
+    async def _reply(self, datagram_id: bytes, frames: List[bytes], addr):
+        verdicts = await self.server._ingest(frames)
+        if self.transport and not self.transport.is_closing():
+            self.transport.sendto(datagram_id + verdicts, addr)
@@ -1,7 +1,92 @@
+from typing import Dict, List, Optional
 from app.services.connection import AppType
+from app.utils.prefix_table import PrefixTable
+
+
+# Address ranges announced by the apps' own networks. These identify a
+# flow from its first packet, before any SNI / Host / DNS name is seen.
+# Shared CDN and multi-app ranges (Meta, Cloudflare, ...) are left out
+# on purpose; add them per deployment through a prefix file.
+DEFAULT_APP_PREFIXES: Dict[AppType, List[str]] = {
+    AppType.NETFLIX: [
+        "23.246.0.0/18", "37.77.184.0/21", "45.57.0.0/17",
+        "64.120.128.0/17", "66.197.128.0/17", "69.53.224.0/19",
+        "108.175.32.0/20", "185.2.220.0/22", "185.9.188.0/22",
+        "192.173.64.0/18", "198.38.96.0/19", "198.45.48.0/20",
+        "208.75.76.0/22", "2a00:86c0::/32", "2620:10c:7000::/44",
+    ],
+    AppType.ZOOM: [
+        "144.195.0.0/16", "170.114.0.0/16", "206.247.0.0/16",
+    ],
+    AppType.TELEGRAM: [
+        "91.105.192.0/23", "91.108.4.0/22", "91.108.8.0/22",
+        "91.108.12.0/22", "91.108.16.0/22", "91.108.20.0/22",
+        "91.108.56.0/22", "149.154.160.0/20", "185.76.151.0/24",
+        "2001:67c:4e8::/48", "2001:b28:f23c::/48", "2001:b28:f23d::/48",
+        "2001:b28:f23f::/48", "2a0a:f280::/32",
+    ],
+}
+
+
+def build_prefix_table(prefix_file: Optional[str] = None) -> PrefixTable[AppType]:
+    """
+    Build the prefix -> app table from the built-in list plus an optional
+    file with one "<prefix>,<APP>" entry per line ('#' starts a comment).
+    ASN based lists are expected to be expanded to prefixes beforehand.
+    """
+    table: PrefixTable[AppType] = PrefixTable()
+
+    for app, prefixes in DEFAULT_APP_PREFIXES.items():
+        for prefix in prefixes:
+            table.add(prefix, app)
+
+    if prefix_file:
+        with open(prefix_file, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, start=1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.replace(",", " ").split()
+                if len(fields) < 2:
+                    raise ValueError(f"{prefix_file}:{lineno}: expected '<prefix>,<APP>', got '{line}'")
+                prefix, app = fields[:2]
+                try:
+                    table.add(prefix, AppType(app.upper()))
+                except ValueError as e:
+                    raise ValueError(f"{prefix_file}:{lineno}: {e}") from e
+
+    return table.build()
+
+
+_default_table: Optional[PrefixTable[AppType]] = None
+
 
 class ClassificationService:
 
+    def __init__(self, prefix_table: Optional[PrefixTable[AppType]] = None):
+        global _default_table
+
+        if prefix_table is None:
+            if _default_table is None:
+                _default_table = build_prefix_table()
+            prefix_table = _default_table
+
+        self.prefix_table = prefix_table
+
+    def ip_to_app(self, *ips: Optional[str]) -> AppType:
+        """
+        Classify by address range. The first address that falls in a
+        known prefix wins, so pass the server side first.
+        """
+        for ip in ips:
+            if not ip:
+                continue
+            app = self.prefix_table.lookup(ip)
+            if app is not None:
+                return app
+
+        return AppType.UNKNOWN
+
     def sni_to_app(self, sni: str) -> AppType:
         if not sni:
             return AppType.UNKNOWN
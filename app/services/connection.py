@@ -1,161 +1,440 @@
-import asyncio
-from datetime import datetime, timedelta, timezone
-from typing import Dict, Callable, List
+import zlib
+from collections import OrderedDict, deque
+from typing import Callable, Deque, List, NamedTuple, Optional, Tuple
 
 from app.schema.connection_schema import (
     FiveTupleSchema,
     ConnectionSchema,
     ConnectionState,
     AppType,
+    PacketAction,
+    Protocol,
 )
+from app.utils.coarse_clock import clock
+from app.utils.timing_wheel import HierarchicalTimingWheel
+
+
+FlowKey = Tuple[str, int, str, int, Protocol]
+
+
+def flow_key(tuple) -> FlowKey:
+    """Canonical key: both directions of a connection map to the same key."""
+    a = (tuple.src_ip, tuple.src_port)
+    b = (tuple.dst_ip, tuple.dst_port)
+    if b < a:
+        a, b = b, a
+    return (a[0], a[1], b[0], b[1], tuple.protocol)
+
+
+def flow_hash(key: FlowKey) -> int:
+    """CRC32 of a canonical key: symmetric, and stable across processes and restarts."""
+    return zlib.crc32(f"{key[0]}|{key[1]}|{key[2]}|{key[3]}|{key[4].value}".encode())
+
+
+DNS_PORT = 53
+
+# Why a flow left the table (passed to on_expire)
+EXPIRE_IDLE = "idle"
+EXPIRE_CLOSED = "closed"
+EXPIRE_EVICTED = "evicted"
+
+# TCP states after which a flow only lingers briefly before release
+TCP_CLOSED_STATES = ("TIME_WAIT", "CLOSED")
 
-class ConnectionTracker:
 
-    def __init__(self, fp_id: int, max_connections: int = 100000):
+class FlowTimeouts(NamedTuple):
+    """Idle timeouts in seconds, by protocol and TCP state."""
+    tcp_established: float = 1800.0
+    # Handshake in progress, or closing
+    tcp_transitory: float = 30.0
+    udp: float = 60.0
+    dns: float = 10.0
+    icmp: float = 30.0
+    # TIME_WAIT / CLOSED flows are kept this long to absorb stray packets
+    tcp_linger: float = 2.0
+
+    @classmethod
+    def from_config(cls, config) -> "FlowTimeouts":
+        return cls(
+            tcp_established=config.tcp_established_timeout,
+            tcp_transitory=config.tcp_transitory_timeout,
+            udp=config.udp_timeout,
+            dns=config.dns_timeout,
+            icmp=config.icmp_timeout,
+            tcp_linger=config.tcp_linger_timeout,
+        )
+
+
+class FlowRecord:
+    """
+    Compact internal flow record.
+
+    Plain __slots__ attributes with integer counters and coarse monotonic
+    timestamps; a fraction of the memory of a ConnectionSchema with its
+    nested tuple model and datetimes. Converted to ConnectionSchema only
+    when a flow is reported.
+    """
+
+    __slots__ = (
+        "src_ip", "dst_ip", "src_port", "dst_port", "protocol",
+        "state", "app_type", "action", "sni", "tcp_state",
+        "first_seen", "last_seen",
+        "packets_in", "packets_out", "bytes_in", "bytes_out",
+        "verdict_epoch", "block_rule", "fin_mask", "flow_id",
+    )
+
+    def __init__(self, tuple: FiveTupleSchema, now: float, flow_id: int = 0):
+        # Creation order within the owning shard; stable paging cursor
+        self.flow_id = flow_id
+
+        self.src_ip = tuple.src_ip
+        self.dst_ip = tuple.dst_ip
+        self.src_port = tuple.src_port
+        self.dst_port = tuple.dst_port
+        self.protocol = tuple.protocol
+
+        self.state = ConnectionState.NEW
+        self.app_type = AppType.UNKNOWN
+        self.action = PacketAction.ALLOW
+        self.sni: Optional[str] = None
+        self.tcp_state: Optional[str] = None
+
+        self.first_seen = now
+        self.last_seen = now
+
+        self.packets_in = 0
+        self.packets_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        # Ruleset epoch `action` was computed under (None = not evaluated)
+        self.verdict_epoch: Optional[int] = None
+        # Key of the rule behind a DROP verdict, for hit counters
+        self.block_rule: Optional[str] = None
+        # FINs seen so far, one bit per direction
+        self.fin_mask = 0
+
+    def is_from_initiator(self, tuple: FiveTupleSchema) -> bool:
+        """True when a packet travels in the direction of the flow's first packet."""
+        return tuple.src_port == self.src_port and tuple.src_ip == self.src_ip
+
+    def to_schema(self) -> ConnectionSchema:
+        # Values were validated on the way in; skip re-validation
+        return ConnectionSchema.model_construct(
+            tuple=FiveTupleSchema.model_construct(
+                src_ip=self.src_ip,
+                dst_ip=self.dst_ip,
+                src_port=self.src_port,
+                dst_port=self.dst_port,
+                protocol=self.protocol,
+            ),
+            state=self.state,
+            app_type=self.app_type,
+            action=self.action,
+            sni=self.sni,
+            first_seen=clock.to_datetime(self.first_seen),
+            last_seen=clock.to_datetime(self.last_seen),
+            packets_in=self.packets_in,
+            packets_out=self.packets_out,
+            bytes_in=self.bytes_in,
+            bytes_out=self.bytes_out,
+            tcp_state=self.tcp_state,
+        )
+
+    def to_dict(self) -> dict:
+        """JSON-ready form matching ConnectionSchema, without building a model."""
+        return {
+            "tuple": {
+                "src_ip": self.src_ip,
+                "dst_ip": self.dst_ip,
+                "src_port": self.src_port,
+                "dst_port": self.dst_port,
+                "protocol": self.protocol.value,
+            },
+            "state": self.state.value,
+            "app_type": self.app_type.value,
+            "action": self.action.value,
+            "sni": self.sni,
+            "first_seen": clock.to_datetime(self.first_seen).isoformat(),
+            "last_seen": clock.to_datetime(self.last_seen).isoformat(),
+            "packets_in": self.packets_in,
+            "packets_out": self.packets_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "tcp_state": self.tcp_state,
+        }
+
+
+class ConnectionTracker:
+    """
+    Flow table keyed by the direction-independent 5-tuple.
+
+    Flows are kept in recency order (least recently seen first), so
+    touching a flow and evicting the oldest one are both O(1).
+
+    A tracker is a shard owned by exactly one worker. Every method is
+    synchronous and never awaits, so on the event loop each call runs to
+    completion without interleaving and no lock is needed. Other
+    components read a shard through snapshot(), which copies the record
+    references in one step.
+    """
+
+    def __init__(
+        self,
+        fp_id: int,
+        max_connections: int = 100000,
+        timeouts: FlowTimeouts | None = None,
+        on_expire: Callable[[FlowRecord, str], None] | None = None,
+    ):
         self.fp_id = fp_id
         self.max_connections = max_connections
+        self.timeouts = timeouts or FlowTimeouts()
+        # Called with every flow removed from the table and the reason
+        self.on_expire = on_expire
+
+        self._connections: "OrderedDict[FlowKey, FlowRecord]" = OrderedDict()
 
-        self._connections: Dict[str, ConnectionSchema] = {}
-        self._lock = asyncio.Lock()
+        # Idle deadlines. A flow is armed once when created and re-armed
+        # lazily when its deadline fires, so packets never touch the wheel.
+        self._wheel: HierarchicalTimingWheel[FlowKey] = HierarchicalTimingWheel(
+            tick=1.0, slots=64, levels=3, now=clock.now,
+        )
+        self._due: Deque[FlowKey] = deque()
+        # Closed TCP flows in close order: (release at, key, record)
+        self._linger: Deque[Tuple[float, FlowKey, FlowRecord]] = deque()
 
         self.total_seen = 0
         self.classified_count = 0
         self.blocked_count = 0
+        self.expired_count = 0
+        self.closed_count = 0
 
     # -------------------------------------------------
     # Internal Helpers
     # -------------------------------------------------
 
-    def _key(self, tuple: FiveTupleSchema) -> str:
-        a = f"{tuple.src_ip}:{tuple.src_port}"
-        b = f"{tuple.dst_ip}:{tuple.dst_port}"
-        left, right = sorted([a, b])
-        return f"{left}-{right}-{tuple.protocol}"
+    def _idle_timeout(self, conn: FlowRecord) -> float:
+        if conn.protocol == Protocol.TCP:
+            if conn.tcp_state == "ESTABLISHED":
+                return self.timeouts.tcp_established
+            return self.timeouts.tcp_transitory
+
+        if conn.protocol == Protocol.UDP:
+            if DNS_PORT in (conn.src_port, conn.dst_port):
+                return self.timeouts.dns
+            return self.timeouts.udp
+
+        return self.timeouts.icmp
 
     # -------------------------------------------------
     # Core API
     # -------------------------------------------------
 
-    async def get_or_create(self, tuple: FiveTupleSchema) -> ConnectionSchema:
-        key = self._key(tuple)
+    def get_or_create(self, tuple: FiveTupleSchema) -> FlowRecord:
+        key = flow_key(tuple)
 
-        async with self._lock:
-            conn = self._connections.get(key)
+        conn = self._connections.get(key)
 
-            if conn:
-                return conn
+        if conn:
+            self._connections.move_to_end(key)
+            return conn
 
-            if len(self._connections) >= self.max_connections:
-                self._evict_oldest()
+        if len(self._connections) >= self.max_connections:
+            self._evict_oldest()
 
-            now = datetime.now(timezone.utc)
+        self.total_seen += 1
+        conn = FlowRecord(tuple, clock.now, flow_id=self.total_seen)
+        self._connections[key] = conn
+        self._wheel.schedule(key, conn.last_seen + self._idle_timeout(conn))
 
-            conn = ConnectionSchema(
-                tuple=tuple,
-                state=ConnectionState.NEW,
-                first_seen=now,
-                last_seen=now,
-            )
+        return conn
 
-            self._connections[key] = conn
-            self.total_seen += 1
+    def update(self, conn: FlowRecord, size: int, outbound: bool):
+        conn.last_seen = clock.now
 
-            return conn
+        if outbound:
+            conn.packets_out += 1
+            conn.bytes_out += size
+        else:
+            conn.packets_in += 1
+            conn.bytes_in += size
+
+    def classify(self, conn: FlowRecord, app: AppType, sni: str | None):
+        if conn.state != ConnectionState.CLASSIFIED:
+            self.classified_count += 1
+
+        conn.state = ConnectionState.CLASSIFIED
+        conn.app_type = app
+        conn.sni = sni
 
-    async def update(self, conn: ConnectionSchema, size: int, outbound: bool):
-        async with self._lock:
-            conn.last_seen = datetime.now(timezone.utc)
+        # Inputs to the rule check changed
+        conn.verdict_epoch = None
 
-            if outbound:
-                conn.packets_out += 1
-                conn.bytes_out += size
-            else:
-                conn.packets_in += 1
-                conn.bytes_in += size
+    def set_sni(self, conn: FlowRecord, sni: str):
+        conn.sni = sni
 
-    async def classify(self, conn: ConnectionSchema, app: AppType, sni: str | None):
-        async with self._lock:
-            if conn.state != ConnectionState.CLASSIFIED:
-                self.classified_count += 1
+        # Inputs to the rule check changed
+        conn.verdict_epoch = None
 
-            conn.state = ConnectionState.CLASSIFIED
-            conn.app_type = app
-            conn.sni = sni
+    def reopen(self, tuple: FiveTupleSchema) -> FlowRecord:
+        """Replace a closed flow whose 5-tuple is reused by a new connection."""
+        self.close(tuple)
+        return self.get_or_create(tuple)
+
+    def update_tcp_state(self, conn: FlowRecord, state: str):
+        if state == conn.tcp_state:
+            return
 
-    async def update_tcp_state(self, conn: ConnectionSchema, state: str):
-        async with self._lock:
-            conn.tcp_state = state
+        conn.tcp_state = state
 
-    async def block(self, conn: ConnectionSchema):
-        async with self._lock:
-            if conn.state != ConnectionState.BLOCKED:
-                self.blocked_count += 1
+        if state in TCP_CLOSED_STATES:
+            self._linger.append((clock.now + self.timeouts.tcp_linger, flow_key(conn), conn))
 
+    def block(self, conn: FlowRecord):
+        if conn.state != ConnectionState.BLOCKED:
+            self.blocked_count += 1
+
+        conn.state = ConnectionState.BLOCKED
+
+    def set_verdict(
+        self,
+        conn: FlowRecord,
+        blocked: bool,
+        epoch: int | None,
+        rule: str | None = None,
+    ):
+        conn.action = PacketAction.DROP if blocked else PacketAction.ALLOW
+        conn.verdict_epoch = epoch
+        conn.block_rule = rule
+
+        if blocked and conn.state != ConnectionState.BLOCKED:
+            self.blocked_count += 1
             conn.state = ConnectionState.BLOCKED
 
-    async def close(self, tuple: FiveTupleSchema):
-        key = self._key(tuple)
+        elif not blocked and conn.state == ConnectionState.BLOCKED:
+            # A rule was removed since the flow got blocked
+            conn.state = (
+                ConnectionState.CLASSIFIED
+                if conn.app_type != AppType.UNKNOWN
+                else ConnectionState.NEW
+            )
+
+    def close(self, tuple: FiveTupleSchema):
+        key = flow_key(tuple)
 
-        async with self._lock:
-            if key in self._connections:
-                self._connections[key].state = ConnectionState.CLOSED
-                del self._connections[key]
+        conn = self._connections.pop(key, None)
+        if conn is not None:
+            conn.state = ConnectionState.CLOSED
+            self._wheel.cancel(key)
+            self.closed_count += 1
+            if self.on_expire:
+                self.on_expire(conn, EXPIRE_CLOSED)
 
     # -------------------------------------------------
     # Cleanup
     # -------------------------------------------------
 
-    async def cleanup_stale(self, timeout_seconds: int = 300) -> int:
-        cutoff = datetime.now(timezone.utc) - timedelta(seconds=timeout_seconds)
+    def expire(self, limit: int = 512) -> int:
+        """
+        Release closed TCP flows whose linger time is up, then reclaim idle
+        flows, visiting at most `limit` entries of each.
 
-        async with self._lock:
-            to_remove = [
-                key for key, conn in self._connections.items()
-                if conn.last_seen < cutoff
-            ]
+        An idle deadline only says the flow *may* be idle: the flow's current
+        timeout is re-checked against last_seen, and a flow that saw
+        traffic (or changed TCP state) is re-armed instead. Call again
+        while has_expiring() is true to finish the backlog.
+        """
+        now = clock.now
+        released = self._release_closed(now, limit)
 
-            for key in to_remove:
-                del self._connections[key]
+        if not self._due:
+            self._due.extend(self._wheel.advance(now))
 
-            return len(to_remove)
+        removed = 0
+        for _ in range(min(limit, len(self._due))):
+            key = self._due.popleft()
 
-    def _evict_oldest(self):
-        if not self._connections:
-            return
-
-        oldest_key = min(
-            self._connections,
-            key=lambda k: self._connections[k].last_seen
+            conn = self._connections.get(key)
+            if conn is None:
+                continue
+
+            deadline = conn.last_seen + self._idle_timeout(conn)
+            if deadline > now:
+                self._wheel.schedule(key, deadline)
+                continue
+
+            del self._connections[key]
+            removed += 1
+            if self.on_expire:
+                self.on_expire(conn, EXPIRE_IDLE)
+
+        self.expired_count += removed
+        return released + removed
+
+    def _release_closed(self, now: float, limit: int) -> int:
+        released = 0
+
+        # Linger time is fixed, so the queue is already in deadline order
+        while self._linger and released < limit and self._linger[0][0] <= now:
+            _, key, conn = self._linger.popleft()
+
+            # Skip flows already evicted, or whose tuple was reused since
+            if self._connections.get(key) is not conn:
+                continue
+            if conn.tcp_state not in TCP_CLOSED_STATES:
+                continue
+
+            del self._connections[key]
+            self._wheel.cancel(key)
+            released += 1
+            if self.on_expire:
+                self.on_expire(conn, EXPIRE_CLOSED)
+
+        self.closed_count += released
+        return released
+
+    def has_expiring(self) -> bool:
+        return bool(self._due) or (
+            bool(self._linger) and self._linger[0][0] <= clock.now
         )
 
-        del self._connections[oldest_key]
+    def _evict_oldest(self):
+        if self._connections:
+            key, conn = self._connections.popitem(last=False)
+            self._wheel.cancel(key)
+            if self.on_expire:
+                self.on_expire(conn, EXPIRE_EVICTED)
 
     # -------------------------------------------------
     # Stats
     # -------------------------------------------------
 
-    async def get_active_count(self) -> int:
-        async with self._lock:
-            return len(self._connections)
-
-    async def get_stats(self):
-        async with self._lock:
-            return {
-                "active_connections": len(self._connections),
-                "total_connections_seen": self.total_seen,
-                "classified_connections": self.classified_count,
-                "blocked_connections": self.blocked_count,
-            }
-
-    async def get_all(self) -> List[ConnectionSchema]:
-        async with self._lock:
-            return list(self._connections.values())
-
-    async def for_each(self, callback: Callable[[ConnectionSchema], None]):
-        async with self._lock:
-            for conn in self._connections.values():
-                callback(conn)
-
-    async def clear(self):
-        async with self._lock:
-            self._connections.clear()
\ No newline at end of file
+    def get_active_count(self) -> int:
+        return len(self._connections)
+
+    def get_stats(self):
+        return {
+            "active_connections": len(self._connections),
+            "total_connections_seen": self.total_seen,
+            "classified_connections": self.classified_count,
+            "blocked_connections": self.blocked_count,
+            "expired_connections": self.expired_count,
+            "closed_connections": self.closed_count,
+            "lingering_connections": len(self._linger),
+        }
+
+    def get_all(self) -> List[ConnectionSchema]:
+        return [conn.to_schema() for conn in self._connections.values()]
+
+    def snapshot(self) -> List[FlowRecord]:
+        return list(self._connections.values())
+
+    def for_each(self, callback: Callable[[FlowRecord], None]):
+        for conn in self._connections.values():
+            callback(conn)
+
+    def clear(self):
+        self._connections.clear()
+        self._wheel.clear()
+        self._due.clear()
+        self._linger.clear()
\ No newline at end of file
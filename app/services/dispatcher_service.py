@@ -1,81 +1,324 @@
-from typing import List
+import asyncio
+import sys
+from collections import deque
+from typing import Awaitable, Deque, List, Optional, Tuple
+
+from app.services.connection import FlowRecord, FlowTimeouts, flow_hash, flow_key
+from app.schema.dpi_config_schema import DPIConfig
 from app.schema.packet_schema import PacketSchema
+from app.services.cardinality_service import CardinalityStats
+from app.services.classification_service import ClassificationService
 from app.services.fast_path import FastPathProcessor
+from app.services.flow_export_service import FlowExportService
 from app.services.rule_service import RuleService
+from app.services.top_talkers_service import TopTalkers
+from app.services.worker_process import ProcessWorker
+
+
+WORKER_MODES = ("async", "process")
+
+# What happens to a packet whose worker queue is full:
+#   block - the submitter waits for room
+#   shed  - the packet is dropped
+#   spill - the packet waits in the overflow worker's backlog for its
+#           owner; later packets for that owner queue behind it
+OVERLOAD_POLICIES = ("block", "shed", "spill")
+
+
+def _imbalance(values: List[int]) -> float:
+    """Max over mean; 1.0 is perfectly even."""
+    mean = sum(values) / len(values) if values else 0
+    return round(max(values) / mean, 3) if mean else 1.0
+
+
+async def _first_of(waits: List[Awaitable]):
+    """Wait until any of `waits` completes; cancel the rest."""
+    tasks = [asyncio.ensure_future(w) for w in waits]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 class DispatcherService:
 
-    def __init__(self, num_processors: int, output_callback, queue_size: int = 10000):
+    def __init__(
+        self,
+        num_processors: int,
+        output_callback,
+        queue_size: int = 10000,
+        classifier: ClassificationService | None = None,
+        rule_service: RuleService | None = None,
+        flow_timeouts: FlowTimeouts | None = None,
+        flow_exporter: FlowExportService | None = None,
+        worker_mode: str = "async",
+        config: DPIConfig | None = None,
+        overload_policy: str = "block",
+        spill_capacity: int = 100000,
+    ):
+        """
+        In "process" mode each worker is a ProcessWorker built from
+        `config`; classifier, rule_service, flow_timeouts and
+        flow_exporter are then constructed inside the worker processes.
+
+        Every packet of a flow, in both directions, goes to the same
+        worker, whatever the overload policy.
+        """
+        if worker_mode not in WORKER_MODES:
+            raise ValueError(f"Unknown worker mode '{worker_mode}', expected one of {WORKER_MODES}")
+        if overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy '{overload_policy}', expected one of {OVERLOAD_POLICIES}")
+        if worker_mode == "process" and config is None:
+            raise ValueError("Process workers need the engine config")
+
         self.num_processors = num_processors
-        self.rule_service = RuleService()
+        self.rule_service = rule_service or RuleService()
         self.output_callback = output_callback
+        self.classifier = classifier or ClassificationService()
 
-        self.processors: List[FastPathProcessor] = []
+        self.worker_mode = worker_mode
+        self.processors: List[FastPathProcessor | ProcessWorker] = []
         self.dispatch_counts: List[int] = [0] * num_processors
         self.dropped_count = 0
 
+        # Overload handling
+        self.overload_policy = overload_policy
+        self.spill_capacity = spill_capacity
+        self.blocked_count = 0
+        self.spill_counts: List[int] = [0] * num_processors
+        self._spill: List[Deque[Tuple[PacketSchema, asyncio.Future]]] = [deque() for _ in range(num_processors)]
+        self._spill_size = 0
+        self._spill_ready = asyncio.Event()
+        self._overflow: Optional[asyncio.Task] = None
+
         for i in range(num_processors):
+            if worker_mode == "process":
+                self.processors.append(ProcessWorker(
+                    fp_id=i,
+                    config=config,
+                    output_callback=self.output_callback,
+                    ring_slots=config.worker_ring_slots,
+                ))
+                continue
+
             processor = FastPathProcessor(
                 fp_id=i,
                 rule_service=self.rule_service,
                 output_callback=self.output_callback,
                 queue_size=queue_size,
+                classifier=self.classifier,
+                flow_timeouts=flow_timeouts,
+                flow_exporter=flow_exporter,
             )
             self.processors.append(processor)
 
     async def start(self):
-        for processor in self.processors:
-            await processor.start()
+        await asyncio.gather(*(processor.start() for processor in self.processors))
+        if self.overload_policy == "spill" and not self._overflow:
+            self._overflow = asyncio.create_task(self._run_overflow())
 
     async def stop(self):
-        for processor in self.processors:
-            await processor.stop()
+        if self._overflow:
+            self._overflow.cancel()
+            try:
+                await self._overflow
+            except asyncio.CancelledError:
+                pass
+            self._overflow = None
 
-    async def dispatch(self, packet: PacketSchema) -> str:
-        index = self._select_processor(packet)
+        # Hand the backlog over before the workers drain and stop
+        for index, spill in enumerate(self._spill):
+            while spill:
+                packet, future = spill.popleft()
+                self._spill_size -= 1
+                if await self.processors[index].submit(packet, future) is not None:
+                    self.dispatch_counts[index] += 1
+                elif not future.done():
+                    # Worker already gone: shed, and count it like any drop
+                    self.dropped_count += 1
+                    await self.output_callback(packet, "DROP")
+                    future.set_result("DROP")
+
+        await asyncio.gather(*(processor.stop() for processor in self.processors))
+
+    # ==============================
+    # Submission
+    # ==============================
+
+    def _select_processor(self, packet: PacketSchema) -> int:
+        return flow_hash(flow_key(packet.tuple)) % self.num_processors
 
-        # Try primary worker
-        success = self.processors[index].input_queue.try_push(packet)
+    def _try_submit(self, packet: PacketSchema, index: int) -> Optional[asyncio.Future]:
+        spill = self._spill[index]
 
-        if success:
-            self.dispatch_counts[index] += 1
-            return "ALLOW"
+        # Never overtake packets already waiting for this worker
+        if not spill:
+            future = self.processors[index].try_submit(packet)
+            if future is not None:
+                self.dispatch_counts[index] += 1
+                return future
 
-        # Fallback: try other workers round-robin before dropping
-        for i in range(1, self.num_processors):
-            fallback_index = (index + i) % self.num_processors
-            success = self.processors[fallback_index].input_queue.try_push(packet)
+        if self.overload_policy == "spill" and self._spill_size < self.spill_capacity:
+            if not spill:
+                # A new owner for the overflow worker to watch
+                self._spill_ready.set()
+            future = asyncio.get_running_loop().create_future()
+            spill.append((packet, future))
+            self._spill_size += 1
+            self.spill_counts[index] += 1
+            return future
 
-            if success:
-                self.dispatch_counts[fallback_index] += 1
-                return "ALLOW"
+        return None
 
-        # All queues full
+    async def submit(self, packet: PacketSchema) -> Optional[asyncio.Future]:
+        """
+        Hand a packet to the worker that owns its flow. Returns a future
+        for the worker's verdict, or None when the packet was shed.
+        """
+        index = self._select_processor(packet)
+        future = self._try_submit(packet, index)
+        if future is None:
+            future = await self._submit_overloaded(packet, index)
+        return future
+
+    async def submit_many(self, packets: List[PacketSchema]) -> List[Optional[asyncio.Future]]:
+        futures = []
+        for packet in packets:
+            index = self._select_processor(packet)
+            future = self._try_submit(packet, index)
+            if future is None:
+                future = await self._submit_overloaded(packet, index)
+            futures.append(future)
+        return futures
+
+    async def _submit_overloaded(self, packet: PacketSchema, index: int) -> Optional[asyncio.Future]:
+        if self.overload_policy == "block":
+            self.blocked_count += 1
+            future = await self.processors[index].submit(packet)
+            if future is not None:
+                self.dispatch_counts[index] += 1
+                return future
         self.dropped_count += 1
-        return "DROPPED"
+        return None
 
-    def _select_processor(self, packet: PacketSchema) -> int:
-        key = (
-            f"{packet.tuple.src_ip}:"
-            f"{packet.tuple.src_port}:"
-            f"{packet.tuple.dst_ip}:"
-            f"{packet.tuple.dst_port}:"
-            f"{packet.tuple.protocol}"
+    async def dispatch(self, packet: PacketSchema) -> str:
+        """The worker's verdict ("ALLOW" / "DROP"), or "DROPPED" if shed."""
+        future = await self.submit(packet)
+        if future is None:
+            return "DROPPED"
+        return await future
+
+    async def _run_overflow(self):
+        # The overflow worker: feeds each backlog to its owner, in order,
+        # as room appears. It sleeps until an owner it waits on has room
+        # or a backlog starts for another owner.
+        while True:
+            self._spill_ready.clear()
+            waiting = self._feed_spill()
+            await _first_of(
+                [self.processors[index].wait_for_room() for index in waiting]
+                + [self._spill_ready.wait()]
+            )
+
+    def _feed_spill(self) -> List[int]:
+        """Move backlogged packets into their workers; owners still backlogged."""
+        waiting = []
+        for index, spill in enumerate(self._spill):
+            processor = self.processors[index]
+            while spill:
+                packet, future = spill[0]
+                if processor.try_submit(packet, future) is None:
+                    waiting.append(index)
+                    break
+                spill.popleft()
+                self._spill_size -= 1
+                self.dispatch_counts[index] += 1
+        return waiting
+
+    def free_slots(self) -> int:
+        """
+        Packets that can be taken without overloading any worker: the
+        room left in the fullest queue (less its spill backlog), times
+        the number of workers. A flow can only use its own worker's
+        queue, so this assumes traffic spreads evenly; with skewed flows
+        it is a hint, and under "shed" packets for a hot worker may still
+        be dropped.
+        """
+        free = [
+            processor.queue_capacity() - processor.queue_depth() - len(spill)
+            for processor, spill in zip(self.processors, self._spill)
+            if processor.queue_capacity() > 0
+        ]
+        if not free:
+            # Unbounded queues
+            return sys.maxsize
+        return max(0, min(free)) * self.num_processors
+
+    # Cross-shard reads: each shard is copied in one step by its own
+    # worker, so readers never observe a table mid-update. Process
+    # workers answer over their control pipe.
+
+    async def _worker_states(self) -> List[dict]:
+        return await asyncio.gather(*(processor.get_state() for processor in self.processors))
+
+    async def connection_shards(self) -> List[List[FlowRecord]]:
+        """Per-worker record lists, indexed by worker id."""
+        return await asyncio.gather(
+            *(processor.snapshot_connections() for processor in self.processors)
         )
-        return hash(key) % self.num_processors
 
-    def get_dispatch_stats(self) -> dict:
+    async def connection_snapshot(self) -> List[FlowRecord]:
+        records: List[FlowRecord] = []
+        for shard in await self.connection_shards():
+            records.extend(shard)
+        return records
+
+    async def get_connection_stats(self) -> dict:
+        totals: dict = {}
+        for state in await self._worker_states():
+            for name, value in state["connections"].items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    async def get_cardinality(self) -> CardinalityStats:
+        states = await self._worker_states()
+        return CardinalityStats.merge(state["cardinality"] for state in states)
+
+    async def get_top_talkers(self) -> TopTalkers:
+        states = await self._worker_states()
+        return TopTalkers.merge(state["top_talkers"] for state in states)
+
+    async def get_dispatch_stats(self) -> dict:
+        states = await self._worker_states()
+        total = sum(self.dispatch_counts)
+        depths = [processor.queue_depth() for processor in self.processors]
+        active = [state["connections"]["active_connections"] for state in states]
+
         worker_stats = []
-        for i, processor in enumerate(self.processors):
+        for i, state in enumerate(states):
             worker_stats.append({
                 "worker_id": i,
                 "dispatched": self.dispatch_counts[i],
-                "queue_size": processor.input_queue.size(),
-                **processor.stats,
+                "share": round(self.dispatch_counts[i] / total, 4) if total else 0.0,
+                "queue_size": depths[i],
+                "spilled": self.spill_counts[i],
+                "spill_backlog": len(self._spill[i]),
+                "active_connections": active[i],
+                **state["stats"],
             })
         return {
-            "total_dispatched": sum(self.dispatch_counts),
+            "worker_mode": self.worker_mode,
+            "overload_policy": self.overload_policy,
+            "total_dispatched": total,
             "total_dropped_backpressure": self.dropped_count,
+            "total_blocked": self.blocked_count,
+            "total_spilled": sum(self.spill_counts),
+            "spill_backlog": self._spill_size,
+            "imbalance": {
+                "dispatched": _imbalance(self.dispatch_counts),
+                "active_connections": _imbalance(active),
+                "queue_size": _imbalance(depths),
+            },
             "workers": worker_stats,
         }
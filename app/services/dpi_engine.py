@@ -1,12 +1,24 @@
+import asyncio
+from typing import List
 from app.schema.dpi_config_schema import DPIConfig
 from app.schema.packet_schema import PacketSchema
 from app.schema.common_schema import IngestResponse
 from app.schema.stats_schema import StatsResponse
-from app.schema.connection_schema import ConnectionState
+from app.services.batch_ingest_service import IngestCredits
+from app.services.binary_ingest_service import BinaryIngestServer
+from app.services.classification_service import ClassificationService, build_prefix_table
 from app.services.dispatcher_service import DispatcherService
-from app.services.connection import ConnectionTracker
+from app.services.flow_export_service import FlowExportService
+from app.services.flow_query_service import FlowFilter, query_flows, stream_flows
+from app.services.connection import FlowTimeouts
+from app.services.rule_import_service import detect_format, parse_rules
 from app.services.rule_service import RuleService
 from app.services.stats_service import StatsService
+from app.utils.coarse_clock import clock
+
+
+# Domains listed by name in /stats/apps; all are counted in `distinct`
+MAX_DOMAINS_LISTED = 1000
 
 
 class DPIEngine:
@@ -19,14 +31,36 @@ class DPIEngine:
         self.config = config
 
         # Core Components
+        self.classifier = ClassificationService(
+            build_prefix_table(config.app_prefixes_file)
+            if config.app_prefixes_file else None
+        )
+        self.rule_service = RuleService()
+        self.flow_exporter = FlowExportService.from_config(config)
         self.dispatcher = DispatcherService(
             config.num_workers,
             output_callback=self.handle_output,
             queue_size=config.queue_size,
+            classifier=self.classifier,
+            rule_service=self.rule_service,
+            flow_timeouts=FlowTimeouts.from_config(config),
+            flow_exporter=self.flow_exporter,
+            worker_mode=config.worker_mode,
+            config=config,
+            overload_policy=config.overload_policy,
+            spill_capacity=config.spill_capacity,
         )
-        self.connection_tracker = ConnectionTracker(fp_id=0)
-        self.rule_service = RuleService()
         self.stats_service = StatsService()
+        self.ingest_credits = IngestCredits(self.dispatcher.free_slots)
+        self.binary_ingest = (
+            BinaryIngestServer(
+                self.ingest_batch,
+                host=config.binary_ingest_host,
+                port=config.binary_ingest_port,
+                udp_port=config.binary_ingest_udp_port,
+            )
+            if config.binary_ingest_port or config.binary_ingest_udp_port else None
+        )
 
         # Control
         self._running = False
@@ -37,11 +71,28 @@ class DPIEngine:
 
     async def start(self):
         self._running = True
+        await clock.start()
+        if self.flow_exporter:
+            self.flow_exporter.start()
+        await self.rule_service.start()
+        if self.config.rules_file:
+            await self.load_rules_file(
+                self.config.rules_file,
+                replace=self.config.rules_file_replace,
+            )
         await self.dispatcher.start()
+        if self.binary_ingest:
+            await self.binary_ingest.start()
 
     async def stop(self):
         self._running = False
+        if self.binary_ingest:
+            await self.binary_ingest.stop()
         await self.dispatcher.stop()
+        await self.rule_service.stop()
+        if self.flow_exporter:
+            await self.flow_exporter.stop()
+        await clock.stop()
 
     def is_running(self) -> bool:
         return self._running
@@ -51,71 +102,84 @@ class DPIEngine:
     # ==========================================================
 
     async def ingest_packet(self, packet: PacketSchema) -> IngestResponse:
-
-        t = packet.tuple
-
-        # ---- Get or create connection ----
-        conn = await self.connection_tracker.get_or_create(t)
-
-        # ---- Update connection stats ----
-        await self.connection_tracker.update(
-            conn,
-            size=packet.size,
-            outbound=packet.outbound,
-        )
-
-        # ---- Update global stats ----
-        await self.stats_service.record_packet(packet.size)
-        await self.stats_service.record_protocol(t.protocol.value)
-
-        # ---- Dispatch ----
+        """
+        Hand the packet to the worker that owns its flow and wait for the
+        verdict. Tracking, classification, rule checks and stats happen
+        once, in that worker and handle_output().
+        """
         action = await self.dispatcher.dispatch(packet)
 
-        # ---- Rule Check ----
-        block_reason = await self.rule_service.should_block(
-            src_ip=t.src_ip,
-            dst_port=t.dst_port,
-            app=packet.app_type.value if packet.app_type else "UNKNOWN",
-            domain=packet.domain,
-        )
-
-        if block_reason or action == "DROPPED":
-            await self.connection_tracker.block(conn)
-            await self.stats_service.record_drop()
-            return IngestResponse(status="dropped")
-
-        # ---- Classify if needed ----
-        if conn.state != ConnectionState.CLASSIFIED:
-            await self.connection_tracker.classify(
-                conn,
-                app=packet.app_type,
-                sni=packet.domain,
-            )
-
-        app_label = packet.app_type.value if packet.app_type else "UNKNOWN"
-        await self.stats_service.record_app(app_label)
-        await self.stats_service.record_forward()
-
-        return IngestResponse(status="forwarded")
+        if action == "DROPPED":
+            # Never reached a worker
+            await self.handle_output(packet, "DROP")
+
+        return IngestResponse(status="forwarded" if action == "ALLOW" else "dropped")
+
+    async def ingest_batch(self, packets: List[PacketSchema]) -> List[str]:
+        """
+        Submit a batch to the workers in one pass, then await all their
+        verdicts. Returns "forwarded" / "dropped" per packet, in order.
+        """
+        futures = await self.dispatcher.submit_many(packets)
+        submitted = [future for future in futures if future is not None]
+        actions = iter(await asyncio.gather(*submitted, return_exceptions=True))
+
+        statuses = []
+        for packet, future in zip(packets, futures):
+            if future is None:
+                # Never reached a worker
+                await self.handle_output(packet, "DROP")
+                statuses.append("dropped")
+            else:
+                # A packet that failed in its worker counts as dropped
+                statuses.append("forwarded" if next(actions) == "ALLOW" else "dropped")
+        return statuses
 
     # ==========================================================
     # Rule Management APIs
     # ==========================================================
 
-    async def block_ip(self, ip: str):
-        await self.rule_service.block_ip(ip)
+    async def import_rules(self, data: str, fmt: str, default_type: str | None = None, replace: bool = False) -> dict:
+        rules, rejected, rejected_count = parse_rules(data, fmt, default_type)
+        counts = await self.rule_service.import_rules(rules, replace=replace)
+        return {
+            "imported": {t: len(v) for t, v in rules.items()},
+            "totals": counts,
+            "rejected_count": rejected_count,
+            "rejected_samples": rejected,
+        }
+
+    async def load_rules_file(self, path: str, replace: bool = False) -> dict:
+        def read():
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+
+        data = await asyncio.to_thread(read)
+        return await self.import_rules(data, detect_format(filename=path), replace=replace)
+
+    def export_rules(self):
+        return self.rule_service.export_rules()
+
+    async def block_ip(self, ip: str, ttl: int | None = None):
+        await self.rule_service.block_ip(ip, ttl=ttl)
 
     async def unblock_ip(self, ip: str):
         await self.rule_service.unblock_ip(ip)
 
-    async def block_domain(self, domain: str):
-        await self.rule_service.block_domain(domain)
+    async def block_cidr(self, prefix: str, ttl: int | None = None):
+        await self.rule_service.block_cidr(prefix, ttl=ttl)
+
+    async def unblock_cidr(self, prefix: str):
+        await self.rule_service.unblock_cidr(prefix)
+
+    async def block_domain(self, domain: str, ttl: int | None = None):
+        await self.rule_service.block_domain(domain, ttl=ttl)
 
     async def unblock_domain(self, domain: str):
         await self.rule_service.unblock_domain(domain)
 
-    async def block_app(self, app: str):
-        await self.rule_service.block_app(app)
+    async def block_app(self, app: str, ttl: int | None = None):
+        await self.rule_service.block_app(app, ttl=ttl)
 
     async def unblock_app(self, app: str):
         await self.rule_service.unblock_app(app)
@@ -130,19 +194,31 @@ class DPIEngine:
 
     async def get_app_stats(self) -> dict:
         app_distribution = await self.stats_service.get_app_stats()
-        connections = await self.connection_tracker.get_all()
-        unique_domains = list({
-            conn.sni for conn in connections
-            if conn.sni
-        })
+        cardinality = (await self.dispatcher.get_cardinality()).report()
+
+        domains = set()
+        for conn in await self.dispatcher.connection_snapshot():
+            if conn.sni:
+                domains.add(conn.sni)
+                if len(domains) >= MAX_DOMAINS_LISTED:
+                    break
+
         return {
             "app_distribution": app_distribution,
-            "unique_domains": unique_domains,
-            "active_connections": len(connections),
+            "unique_domains": sorted(domains),
+            "distinct": cardinality["distinct"],
+            "distinct_per_app": cardinality["per_app"],
+            "active_connections": (await self.dispatcher.get_connection_stats()).get("active_connections", 0),
         }
 
+    async def get_top_talkers(self, by: str = "bytes", n: int = 10):
+        return (await self.dispatcher.get_top_talkers()).report(by, n)
+
     async def get_dispatch_stats(self) -> dict:
-        return self.dispatcher.get_dispatch_stats()
+        return await self.dispatcher.get_dispatch_stats()
+
+    async def get_rule_stats(self, limit: int = 100, include_unused: bool = False, ascending: bool = False):
+        return await self.rule_service.get_rule_stats(limit, include_unused, ascending)
 
     async def get_blocked_domains(self):
         return await self.rule_service.get_blocked_domains()
@@ -150,6 +226,9 @@ class DPIEngine:
     async def get_blocked_ips(self):
         return await self.rule_service.get_blocked_ips()
 
+    async def get_blocked_cidrs(self):
+        return await self.rule_service.get_blocked_cidrs()
+
     async def get_blocked_apps(self):
         return await self.rule_service.get_blocked_apps()
 
@@ -161,15 +240,42 @@ class DPIEngine:
     # ==========================================================
 
     async def get_active_connections(self):
-        return await self.connection_tracker.get_all()
+        return [conn.to_schema() for conn in await self.dispatcher.connection_snapshot()]
+
+    async def query_connections(
+        self,
+        flt: FlowFilter,
+        cursor: str | None = None,
+        limit: int = 100,
+        sort: str | None = None,
+    ) -> dict:
+        records, next_cursor = query_flows(
+            await self.dispatcher.connection_shards(), flt, cursor, limit, sort,
+        )
+        return {
+            "connections": [conn.to_dict() for conn in records],
+            "count": len(records),
+            "next_cursor": next_cursor,
+        }
+
+    async def stream_connections(self, flt: FlowFilter):
+        return stream_flows(await self.dispatcher.connection_shards(), flt)
 
     async def get_connection_stats(self):
-        return await self.connection_tracker.get_stats()
+        return await self.dispatcher.get_connection_stats()
 
     # ==========================================================
     # Worker Output Callback
     # ==========================================================
 
     async def handle_output(self, packet: PacketSchema, action: str):
+        await self.stats_service.record_packet(packet.size)
+        await self.stats_service.record_protocol(packet.tuple.protocol.value)
+
         if action == "DROP":
             await self.stats_service.record_drop()
+            return
+
+        app_label = packet.app_type.value if packet.app_type else "UNKNOWN"
+        await self.stats_service.record_app(app_label)
+        await self.stats_service.record_forward()
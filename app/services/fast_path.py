@@ -1,13 +1,20 @@
-from typing import Callable, Dict
+import asyncio
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from app.schema.packet_schema import PacketSchema
 from app.schema.connection_schema import (
     ConnectionState,
     AppType,
+    PacketAction,
     Protocol,
 )
-from app.services.connection import ConnectionTracker
-from app.services.rule_service import RuleService
+from app.services.cardinality_service import CardinalityStats
+from app.services.classification_service import ClassificationService
+from app.services.flow_export_service import FlowExportService
+from app.services.connection import ConnectionTracker, FlowRecord, FlowTimeouts, TCP_CLOSED_STATES
+from app.services.rule_service import RuleQuery, RuleService
+from app.services.rule_stats_service import rule_key
+from app.services.top_talkers_service import TopTalkers
 from app.utils.thread_safe_queue import AsyncQueue
 
 
@@ -17,11 +24,26 @@ ACK = 0x10
 FIN = 0x01
 RST = 0x04
 
+# fin_mask bits
+INITIATOR_FIN = 0x01
+RESPONDER_FIN = 0x02
+
+# Idle-flow reaper: wake once per wheel tick, reclaim in small slices
+REAP_INTERVAL = 1.0
+REAP_SLICE = 512
+
+# Most packets a worker takes from its queue per step
+WORKER_BATCH = 256
+
 
 class FastPathProcessor:
     """
     Per-worker packet processor with flow tracking,
     TCP state machine, classification, and rule checking.
+
+    The processor owns its ConnectionTracker shard exclusively: the
+    dispatcher hashes every packet of a flow to the same worker, and
+    only this worker's task mutates the shard.
     """
 
     def __init__(
@@ -30,15 +52,29 @@ class FastPathProcessor:
         rule_service: RuleService,
         output_callback: Callable[[PacketSchema, str], None],
         queue_size: int = 10000,
+        classifier: ClassificationService | None = None,
+        flow_timeouts: FlowTimeouts | None = None,
+        flow_exporter: FlowExportService | None = None,
     ):
         self.fp_id = fp_id
         self.rule_service = rule_service
         self.output_callback = output_callback
+        self.classifier = classifier or ClassificationService()
 
-        self.input_queue: AsyncQueue[PacketSchema] = AsyncQueue(max_size=queue_size)
-        self.conn_tracker = ConnectionTracker(fp_id=fp_id)
+        # Each packet travels with the future its submitter awaits
+        self.input_queue: AsyncQueue[Tuple[PacketSchema, asyncio.Future]] = AsyncQueue(max_size=queue_size)
+        self.flow_exporter = flow_exporter
+        self.conn_tracker = ConnectionTracker(
+            fp_id=fp_id,
+            timeouts=flow_timeouts,
+            on_expire=flow_exporter.offer_flow if flow_exporter else None,
+        )
+
+        self.top_talkers = TopTalkers()
+        self.cardinality = CardinalityStats()
 
         self.task = None
+        self.reaper = None
 
         self.stats: Dict[str, int] = {
             "processed": 0,
@@ -51,11 +87,26 @@ class FastPathProcessor:
     # Lifecycle
     # ==================================================
 
-    async def start(self):
-        if not self.task or self.task.done():
-            self.task = __import__("asyncio").get_event_loop().create_task(self.run())
+    async def start(self, consume: bool = True):
+        """
+        Start the reaper and, unless `consume` is False, the loop that
+        drains input_queue. A caller that feeds process_packet() itself
+        (a worker process reading a ring) passes consume=False.
+        """
+        if consume and (not self.task or self.task.done()):
+            self.task = asyncio.get_event_loop().create_task(self.run())
+        if not self.reaper or self.reaper.done():
+            self.reaper = asyncio.get_event_loop().create_task(self._reap())
 
     async def stop(self):
+        if self.reaper:
+            self.reaper.cancel()
+            try:
+                await self.reaper
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.reaper = None
+
         self.input_queue.shutdown()
         if self.task:
             try:
@@ -64,66 +115,268 @@ class FastPathProcessor:
                 pass
             self.task = None
 
+    # ==================================================
+    # Worker interface (shared with ProcessWorker)
+    # ==================================================
+
+    def try_submit(self, packet: PacketSchema, future: Optional[asyncio.Future] = None) -> Optional[asyncio.Future]:
+        """
+        Enqueue a packet; the future (created unless one is passed in)
+        resolves to its verdict. None when the queue is full.
+        """
+        future = future or asyncio.get_running_loop().create_future()
+        if not self.input_queue.try_push((packet, future)):
+            return None
+        return future
+
+    async def submit(self, packet: PacketSchema, future: Optional[asyncio.Future] = None) -> Optional[asyncio.Future]:
+        """try_submit(), waiting for room instead of failing; None once stopped."""
+        future = future or asyncio.get_running_loop().create_future()
+        if not await self.input_queue.push((packet, future)):
+            return None
+        return future
+
+    async def wait_for_room(self):
+        """Return once the input queue has room, or the worker stopped."""
+        await self.input_queue.wait_not_full()
+
+    def queue_depth(self) -> int:
+        return self.input_queue.size()
+
+    def queue_capacity(self) -> int:
+        return self.input_queue.capacity()
+
+    async def snapshot_connections(self) -> List[FlowRecord]:
+        return self.conn_tracker.snapshot()
+
+    async def get_state(self) -> dict:
+        return {
+            "stats": dict(self.stats),
+            "connections": self.conn_tracker.get_stats(),
+            "top_talkers": self.top_talkers,
+            "cardinality": self.cardinality,
+        }
+
     # ==================================================
     # Main Loop
     # ==================================================
 
     async def run(self):
-        while not self.input_queue.is_shutdown():
-            packet = await self.input_queue.pop_with_timeout(0.5)
-            if packet is None:
+        # Ends once the queue is shut down and drained
+        while True:
+            items = await self.input_queue.pop_many(WORKER_BATCH)
+            if not items:
+                return
+            await self._handle_batch(items)
+
+    async def _handle_batch(self, items: List[Tuple[PacketSchema, asyncio.Future]]):
+        try:
+            results = await self.process_batch([packet for packet, _ in items])
+        except Exception as e:
+            # Packets may already be tracked; fail them rather than re-run
+            results = [e] * len(items)
+
+        for (packet, future), result in zip(items, results):
+            if isinstance(result, Exception):
+                # Fail this packet only; the worker keeps running
+                if not future.done():
+                    future.set_exception(result)
                 continue
+            await self.output_callback(packet, result)
+            if not future.done():
+                future.set_result(result)
 
-            action = await self.process_packet(packet)
-            await self.output_callback(packet, action)
+    async def _reap(self):
+        # Runs on the worker's own loop, so it shares the shard lock-free;
+        # yielding between slices keeps a large expiry burst from
+        # stalling packet processing.
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            self.conn_tracker.expire(REAP_SLICE)
+            while self.conn_tracker.has_expiring():
+                await self._export_backpressure()
+                await asyncio.sleep(0)
+                self.conn_tracker.expire(REAP_SLICE)
+            await self._export_backpressure()
 
-        # Drain remaining packets on shutdown
-        while not self.input_queue.empty():
-            packet = await self.input_queue.pop()
-            if packet is None:
-                break
-            action = await self.process_packet(packet)
-            await self.output_callback(packet, action)
+    async def _export_backpressure(self):
+        # The reaper can wait for the flow writer; the packet path never does
+        if self.flow_exporter and self.flow_exporter.is_backlogged():
+            await self.flow_exporter.drain()
 
     # ==================================================
     # Core Logic
     # ==================================================
 
     async def process_packet(self, packet: PacketSchema) -> str:
+        conn = self._track(packet)
+        epoch = self.rule_service.epoch
+        if self._verdict_stale(conn, epoch):
+            reason = await self.rule_service.should_block(*self._rule_query(conn, packet))
+            self._set_verdict(conn, reason, epoch)
+        return self._apply_verdict(conn, packet)
+
+    async def process_batch(self, packets: List[PacketSchema]) -> List[Union[str, Exception]]:
+        """
+        process_packet() for a whole batch: flows are tracked packet by
+        packet, then every flow whose cached verdict is stale is checked
+        once, in a single should_block_many() call.
+
+        Each packet is tracked exactly once. A packet that fails gets its
+        exception in place of an action; the rest of the batch is
+        unaffected.
+        """
+        conns: List[Union[FlowRecord, Exception]] = []
+        for packet in packets:
+            try:
+                conns.append(self._track(packet))
+            except Exception as e:
+                conns.append(e)
+        epoch = self.rule_service.epoch
+
+        stale: Dict[int, Tuple[FlowRecord, PacketSchema]] = {}
+        for conn, packet in zip(conns, packets):
+            if isinstance(conn, Exception):
+                continue
+            if id(conn) not in stale and self._verdict_stale(conn, epoch):
+                stale[id(conn)] = (conn, packet)
+
+        failed: Dict[int, Exception] = {}
+        if stale:
+            failed = await self._check_rules(list(stale.values()), epoch)
+
+        results: List[Union[str, Exception]] = []
+        for conn, packet in zip(conns, packets):
+            if isinstance(conn, Exception):
+                results.append(conn)
+            elif id(conn) in failed:
+                results.append(failed[id(conn)])
+            else:
+                results.append(self._apply_verdict(conn, packet))
+        return results
+
+    async def _check_rules(self, pending: List[Tuple[FlowRecord, PacketSchema]], epoch) -> Dict[int, Exception]:
+        """
+        Set verdicts for `pending` flows; returns the errors of flows that
+        could not be checked, by id(conn).
+        """
+        try:
+            reasons = await self.rule_service.should_block_many(
+                [self._rule_query(conn, packet) for conn, packet in pending]
+            )
+        except Exception:
+            # Retry flow by flow so only the failing flows are affected
+            failed: Dict[int, Exception] = {}
+            for conn, packet in pending:
+                try:
+                    reason = await self.rule_service.should_block(*self._rule_query(conn, packet))
+                except Exception as e:
+                    failed[id(conn)] = e
+                    continue
+                self._set_verdict(conn, reason, epoch)
+            return failed
+
+        for (conn, _), reason in zip(pending, reasons):
+            self._set_verdict(conn, reason, epoch)
+        return {}
+
+    def _track(self, packet: PacketSchema) -> FlowRecord:
+        """Steps 1-7: flow state, classification and counters."""
         self.stats["processed"] += 1
         t = packet.tuple
 
         # 1. Get or create connection
-        conn = await self.conn_tracker.get_or_create(t)
+        conn = self.conn_tracker.get_or_create(t)
+
+        # A fresh SYN on a closed flow's tuple starts a new connection
+        if (
+            t.protocol == Protocol.TCP
+            and packet.tcp_flags
+            and packet.tcp_flags & (SYN | ACK) == SYN
+            and conn.tcp_state in TCP_CLOSED_STATES
+        ):
+            conn = self.conn_tracker.reopen(t)
 
         # 2. Update connection stats
-        await self.conn_tracker.update(conn, size=packet.size, outbound=packet.outbound)
+        self.conn_tracker.update(conn, size=packet.size, outbound=packet.outbound)
+        new_flow = conn.packets_in + conn.packets_out == 1
+        classified = False
 
         # 3. TCP state tracking
         if t.protocol == Protocol.TCP and packet.tcp_flags:
-            await self._update_tcp_state(conn, packet.tcp_flags)
+            self._update_tcp_state(conn, conn.is_from_initiator(t), packet.tcp_flags)
 
-        # 4. Early exit if already blocked
-        if conn.state == ConnectionState.BLOCKED:
-            self.stats["dropped"] += 1
-            return "DROP"
+        # 4. Address-range classification (before any payload hint)
+        if conn.state == ConnectionState.NEW and conn.app_type == AppType.UNKNOWN:
+            app = self.classifier.ip_to_app(t.dst_ip, t.src_ip)
+            if app != AppType.UNKNOWN:
+                self.conn_tracker.classify(conn, app, packet.domain)
+                self.stats["classification_hits"] += 1
+                classified = True
 
-        # 5. Classification (only if not yet classified)
-        if conn.state != ConnectionState.CLASSIFIED and packet.domain:
-            app = packet.app_type if packet.app_type and packet.app_type != AppType.UNKNOWN else AppType.HTTPS
-            await self.conn_tracker.classify(conn, app, packet.domain)
-            self.stats["classification_hits"] += 1
+        # 5. Domain: classifies a NEW flow; a flow already classified by
+        #    address (SNI after the SYN) still gets the domain recorded,
+        #    which makes its cached verdict stale
+        if packet.domain and not conn.sni:
+            if conn.state == ConnectionState.NEW:
+                app = packet.app_type if packet.app_type and packet.app_type != AppType.UNKNOWN else AppType.HTTPS
+                self.conn_tracker.classify(conn, app, packet.domain)
+                self.stats["classification_hits"] += 1
+            else:
+                self.conn_tracker.set_sni(conn, packet.domain)
+            classified = True
+
+        # 6. Distinct counters (once per flow and per classification)
+        if new_flow or classified:
+            flow = f"{conn.src_ip}:{conn.src_port}-{conn.dst_ip}:{conn.dst_port}/{conn.protocol.value}"
+            if new_flow:
+                self.cardinality.record_flow(conn.src_ip, conn.dst_ip, flow, conn.sni)
+            if classified:
+                self.cardinality.record_app(conn.app_type.value, conn.src_ip, conn.dst_ip, flow, conn.sni)
+
+        # 7. Heavy-hitter sketches
+        self.top_talkers.record(
+            t.src_ip,
+            t.dst_ip,
+            (conn.src_ip, conn.src_port, conn.dst_ip, conn.dst_port, conn.protocol.value),
+            packet.size,
+            conn.sni or packet.domain,
+        )
 
-        # 6. Rule check
-        block_reason = await self.rule_service.should_block(
-            src_ip=t.src_ip,
-            dst_port=t.dst_port,
+        return conn
+
+    # 8. Rule check, cached on the flow until the ruleset epoch moves
+
+    # The epoch is read before the check, so a ruleset swapped in while
+    # it runs leaves the verdict stale rather than wrongly current.
+
+    @staticmethod
+    def _verdict_stale(conn: FlowRecord, epoch: Optional[int]) -> bool:
+        return epoch is None or conn.verdict_epoch != epoch
+
+    @staticmethod
+    def _rule_query(conn: FlowRecord, packet: PacketSchema) -> RuleQuery:
+        return RuleQuery(
+            src_ip=conn.src_ip,
+            dst_port=conn.dst_port,
             app=conn.app_type.value if conn.app_type else "UNKNOWN",
-            domain=packet.domain,
+            domain=conn.sni or packet.domain,
+            # The verdict covers both directions of the flow
+            dst_ip=conn.dst_ip,
+        )
+
+    def _set_verdict(self, conn: FlowRecord, block_reason, epoch: Optional[int]):
+        self.conn_tracker.set_verdict(
+            conn,
+            block_reason is not None,
+            epoch,
+            rule=rule_key(block_reason) if block_reason else None,
         )
 
-        if block_reason:
-            await self.conn_tracker.block(conn)
+    def _apply_verdict(self, conn: FlowRecord, packet: PacketSchema) -> str:
+        if conn.action == PacketAction.DROP:
+            if conn.block_rule:
+                self.rule_service.hits.record(conn.block_rule, packet.size)
             self.stats["dropped"] += 1
             return "DROP"
 
@@ -134,16 +387,42 @@ class FastPathProcessor:
     # TCP State Machine
     # ==================================================
 
-    async def _update_tcp_state(self, conn, tcp_flags: int):
+    def _update_tcp_state(self, conn: FlowRecord, from_initiator: bool, tcp_flags: int):
+        """
+        Track both directions of the connection:
+
+            SYN (initiator)      NEW          -> SYN_SENT
+            SYN+ACK (responder)  SYN_SENT     -> SYN_RECEIVED
+            ACK (initiator)      SYN_RECEIVED -> ESTABLISHED
+            FIN (either side)                 -> FIN_WAIT
+            FIN (other side)     FIN_WAIT     -> TIME_WAIT
+            RST (either side)                 -> CLOSED
+
+        A flow first seen mid-stream (plain ACK) is taken as ESTABLISHED.
+        TIME_WAIT and CLOSED flows are released by the tracker after a
+        short linger.
+        """
         state = conn.tcp_state or "NEW"
 
         if tcp_flags & RST:
             state = "CLOSED"
+
         elif tcp_flags & FIN:
-            state = "CLOSED"
+            conn.fin_mask |= INITIATOR_FIN if from_initiator else RESPONDER_FIN
+            if conn.fin_mask == INITIATOR_FIN | RESPONDER_FIN:
+                state = "TIME_WAIT"
+            elif state not in TCP_CLOSED_STATES:
+                state = "FIN_WAIT"
+
         elif tcp_flags & SYN:
-            state = "SYN_SENT"
-        elif tcp_flags & ACK and state == "SYN_SENT":
-            state = "ESTABLISHED"
+            if not tcp_flags & ACK:
+                if from_initiator and state == "NEW":
+                    state = "SYN_SENT"
+            elif not from_initiator and state in ("NEW", "SYN_SENT"):
+                state = "SYN_RECEIVED"
+
+        elif tcp_flags & ACK:
+            if state == "NEW" or (state == "SYN_RECEIVED" and from_initiator):
+                state = "ESTABLISHED"
 
-        await self.conn_tracker.update_tcp_state(conn, state)
+        self.conn_tracker.update_tcp_state(conn, state)
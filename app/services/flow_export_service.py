@@ -0,0 +1,417 @@
+"""
+Batched export of finished flows.
+
+Flows removed from a ConnectionTracker (idle, closed, evicted) and the
+flows of an analyzed PCAP are buffered into batches and written by a
+background thread, so file I/O never runs on the event loop.
+
+Formats
+-------
+binary   IPFIX-like, network byte order. A file starts with
+         b"DPIF" + u16 format version (1), followed by messages:
+
+             u16  version (10, as IPFIX)
+             u16  reserved
+             u32  message length in bytes, header included
+             u32  export time (Unix seconds)
+             u32  record count
+
+         each followed by `record count` records:
+
+             u64  flow start (ms since epoch)
+             u64  flow end   (ms since epoch)
+             16B  source address (IPv4 as ::ffff:a.b.c.d)
+             16B  destination address
+             u16  source port
+             u16  destination port
+             u8   IP protocol number (6 TCP, 17 UDP, 1 ICMP, 0 other)
+             u8   flags: bit 0 blocked, bits 1-2 end reason
+                  (0 idle, 1 closed, 2 evicted, 3 end of capture)
+             u64  packets
+             u64  bytes
+             u8   app name length, then app name (UTF-8)
+             u8   domain length, then domain (UTF-8, empty if none)
+
+csv      One header row, then one row per flow.
+parquet  One row group per batch. Needs pyarrow.
+
+Files are named flows-<UTC time>-<seq>.<ext> and rotated when they pass
+`rotate_bytes` or are older than `rotate_seconds`.
+"""
+import asyncio
+import csv
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional
+
+from app.schema.connection_schema import PacketAction
+from app.services.connection import (
+    FlowRecord,
+    EXPIRE_IDLE,
+    EXPIRE_CLOSED,
+    EXPIRE_EVICTED,
+)
+from app.services.packet_codec import pack_address
+from app.utils.coarse_clock import clock
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+EXPORT_FORMATS = ("binary", "csv", "parquet")
+
+END_OF_CAPTURE = "end_of_capture"
+
+END_REASON_CODES = {
+    EXPIRE_IDLE: 0,
+    EXPIRE_CLOSED: 1,
+    EXPIRE_EVICTED: 2,
+    END_OF_CAPTURE: 3,
+}
+
+PROTOCOL_NUMBERS = {"TCP": 6, "UDP": 17, "ICMP": 1}
+
+BINARY_MAGIC = b"DPIF"
+BINARY_FILE_VERSION = 1
+IPFIX_VERSION = 10
+
+_FILE_HEADER = struct.Struct(">4sH")
+_MESSAGE_HEADER = struct.Struct(">HHIII")
+_RECORD = struct.Struct(">QQ16s16sHHBBQQ")
+
+
+class FlowExportRecord(NamedTuple):
+    start: float
+    end: float
+    src_ip: str
+    dst_ip: str
+    src_port: int
+    dst_port: int
+    protocol: str
+    app: str
+    domain: Optional[str]
+    packets: int
+    bytes: int
+    blocked: bool
+    end_reason: str
+
+    @classmethod
+    def from_flow(cls, conn: FlowRecord, reason: str) -> "FlowExportRecord":
+        return cls(
+            start=clock.to_epoch(conn.first_seen),
+            end=clock.to_epoch(conn.last_seen),
+            src_ip=conn.src_ip,
+            dst_ip=conn.dst_ip,
+            src_port=conn.src_port,
+            dst_port=conn.dst_port,
+            protocol=conn.protocol.value,
+            app=conn.app_type.value,
+            domain=conn.sni,
+            packets=conn.packets_in + conn.packets_out,
+            bytes=conn.bytes_in + conn.bytes_out,
+            blocked=conn.action == PacketAction.DROP,
+            end_reason=reason,
+        )
+
+
+# =================================================
+# Writers (used only by the writer thread)
+# =================================================
+
+class BinaryFlowWriter:
+    extension = "dpif"
+
+    def __init__(self, path: str):
+        self._file = open(path, "wb")
+        self._file.write(_FILE_HEADER.pack(BINARY_MAGIC, BINARY_FILE_VERSION))
+
+    def write(self, records: List[FlowExportRecord]):
+        body = bytearray()
+        for r in records:
+            body += _RECORD.pack(
+                int(r.start * 1000),
+                int(r.end * 1000),
+                pack_address(r.src_ip),
+                pack_address(r.dst_ip),
+                r.src_port,
+                r.dst_port,
+                PROTOCOL_NUMBERS.get(r.protocol, 0),
+                int(r.blocked) | END_REASON_CODES.get(r.end_reason, 0) << 1,
+                r.packets,
+                r.bytes,
+            )
+            for text in (r.app, r.domain or ""):
+                encoded = text.encode("utf-8")[:255]
+                body.append(len(encoded))
+                body += encoded
+
+        header = _MESSAGE_HEADER.pack(
+            IPFIX_VERSION, 0, _MESSAGE_HEADER.size + len(body), int(time.time()), len(records),
+        )
+        self._file.write(header)
+        self._file.write(body)
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class CsvFlowWriter:
+    extension = "csv"
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FlowExportRecord._fields)
+
+    def write(self, records: List[FlowExportRecord]):
+        self._writer.writerows(
+            (f"{r.start:.3f}", f"{r.end:.3f}", *r[2:8], r.domain or "", *r[9:])
+            for r in records
+        )
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetFlowWriter:
+    extension = "parquet"
+
+    def __init__(self, path: str):
+        self._path = path
+        self._schema = pyarrow.schema([
+            ("start", pyarrow.float64()),
+            ("end", pyarrow.float64()),
+            ("src_ip", pyarrow.string()),
+            ("dst_ip", pyarrow.string()),
+            ("src_port", pyarrow.uint16()),
+            ("dst_port", pyarrow.uint16()),
+            ("protocol", pyarrow.string()),
+            ("app", pyarrow.string()),
+            ("domain", pyarrow.string()),
+            ("packets", pyarrow.uint64()),
+            ("bytes", pyarrow.uint64()),
+            ("blocked", pyarrow.bool_()),
+            ("end_reason", pyarrow.string()),
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, records: List[FlowExportRecord]):
+        columns = list(zip(*records))
+        self._writer.write_table(pyarrow.table(
+            {name: columns[i] for i, name in enumerate(FlowExportRecord._fields)},
+            schema=self._schema,
+        ))
+
+    def size(self) -> int:
+        return os.path.getsize(self._path)
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {
+    "binary": BinaryFlowWriter,
+    "csv": CsvFlowWriter,
+    "parquet": ParquetFlowWriter,
+}
+
+
+# =================================================
+# Service
+# =================================================
+
+class FlowExportService:
+    """
+    Buffers finished flows into batches for a background writer thread.
+
+    offer() never blocks, so trackers can call it from the packet path;
+    once the queue of batches is full, further records are held up to
+    `max_pending` and then counted as dropped. Producers that can wait
+    call drain() (or flush()), which blocks them, not the event loop,
+    until the writer has caught up.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fmt: str = "binary",
+        rotate_bytes: int = 64 * 1024 * 1024,
+        rotate_seconds: float = 3600.0,
+        batch_size: int = 1000,
+        queue_batches: int = 64,
+        max_pending: int = 100000,
+    ):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown flow export format: '{fmt}'")
+        if fmt == "parquet" and pyarrow is None:
+            raise ValueError("Parquet flow export needs pyarrow installed")
+
+        self.directory = directory
+        self.fmt = fmt
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._queue: "queue.Queue[Optional[List[FlowExportRecord]]]" = queue.Queue(maxsize=queue_batches)
+        self._pending: List[FlowExportRecord] = []
+        self._thread: Optional[threading.Thread] = None
+
+        # Writer thread state
+        self._writer = None
+        self._opened_at = 0.0
+        self._sequence = 0
+
+        self.stats = {
+            "exported": 0,
+            "dropped": 0,
+            "files": 0,
+            "write_errors": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config, subdirectory: str | None = None) -> Optional["FlowExportService"]:
+        """Exporter for a DPIConfig, or None when export is disabled."""
+        if not config.flow_export_dir:
+            return None
+        directory = config.flow_export_dir
+        if subdirectory:
+            directory = os.path.join(directory, subdirectory)
+        return cls(
+            directory,
+            fmt=config.flow_export_format,
+            rotate_bytes=config.flow_export_rotate_mb * 1024 * 1024,
+            rotate_seconds=config.flow_export_rotate_seconds,
+        )
+
+    # ==============================
+    # Lifecycle
+    # ==============================
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="flow-export", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if not self._thread:
+            return
+        await self.flush()
+        await asyncio.to_thread(self._queue.put, None)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    # ==============================
+    # Producers
+    # ==============================
+
+    def offer(self, record: FlowExportRecord):
+        if len(self._pending) >= self.max_pending:
+            self.stats["dropped"] += 1
+            return
+
+        self._pending.append(record)
+
+        if len(self._pending) >= self.batch_size:
+            try:
+                self._queue.put_nowait(self._pending[:self.batch_size])
+            except queue.Full:
+                # Writer is behind; keep buffering until drain()
+                return
+            del self._pending[:self.batch_size]
+
+    def offer_flow(self, conn: FlowRecord, reason: str):
+        """ConnectionTracker on_expire hook."""
+        self.offer(FlowExportRecord.from_flow(conn, reason))
+
+    async def drain(self):
+        """Hand every full batch to the writer, waiting while its queue is full."""
+        while len(self._pending) >= self.batch_size:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            await asyncio.to_thread(self._queue.put, batch)
+
+    async def flush(self):
+        await self.drain()
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self._queue.put, batch)
+
+    def is_backlogged(self) -> bool:
+        return len(self._pending) >= self.batch_size
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "queued_batches": self._queue.qsize(),
+        }
+
+    # ==============================
+    # Writer thread
+    # ==============================
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                self._rotate_if_due()
+                continue
+
+            if batch is None:
+                break
+
+            try:
+                if self._writer is None:
+                    self._open()
+                self._writer.write(batch)
+                self.stats["exported"] += len(batch)
+                self._rotate_if_due()
+            except Exception:
+                self.stats["write_errors"] += 1
+                self._close()
+
+        self._close()
+
+    def _open(self):
+        self._sequence += 1
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        writer_cls = WRITERS[self.fmt]
+        path = os.path.join(
+            self.directory, f"flows-{stamp}-{self._sequence:04d}.{writer_cls.extension}",
+        )
+        self._writer = writer_cls(path)
+        self._opened_at = time.monotonic()
+        self.stats["files"] += 1
+
+    def _close(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            finally:
+                self._writer = None
+
+    def _rotate_if_due(self):
+        if self._writer is None:
+            return
+        if (
+            self._writer.size() >= self.rotate_bytes
+            or time.monotonic() - self._opened_at >= self.rotate_seconds
+        ):
+            self._close()
@@ -0,0 +1,132 @@
+import heapq
+import ipaddress
+import json
+from operator import itemgetter
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.schema.connection_schema import PacketAction
+from app.services.connection import FlowRecord
+
+
+# Flows serialized per NDJSON chunk
+STREAM_CHUNK_SIZE = 1000
+
+SORT_KEYS: Dict[str, Callable[[FlowRecord], int]] = {
+    "bytes": lambda conn: conn.bytes_in + conn.bytes_out,
+    "packets": lambda conn: conn.packets_in + conn.packets_out,
+}
+
+
+class FlowFilter(NamedTuple):
+    """
+    Server-side flow filter; unset fields match everything.
+
+    `state` matches either the flow state (NEW, CLASSIFIED, BLOCKED) or
+    the TCP state (ESTABLISHED, FIN_WAIT, ...). `ip` and `port` match
+    either endpoint.
+    """
+    app: Optional[str] = None
+    state: Optional[str] = None
+    ip: Optional[str] = None
+    port: Optional[int] = None
+    blocked: Optional[bool] = None
+
+    @classmethod
+    def build(cls, app=None, state=None, ip=None, port=None, blocked=None) -> "FlowFilter":
+        """Normalize query values; raises ValueError for a malformed IP."""
+        return cls(
+            app=app.upper() if app else None,
+            state=state.upper() if state else None,
+            ip=str(ipaddress.ip_address(ip)) if ip else None,
+            port=port,
+            blocked=blocked,
+        )
+
+    def matches(self, conn: FlowRecord) -> bool:
+        if self.app is not None and conn.app_type.value != self.app:
+            return False
+        if self.state is not None and self.state not in (conn.state.value, conn.tcp_state):
+            return False
+        if self.ip is not None and self.ip not in (conn.src_ip, conn.dst_ip):
+            return False
+        if self.port is not None and self.port not in (conn.src_port, conn.dst_port):
+            return False
+        if self.blocked is not None and (conn.action == PacketAction.DROP) != self.blocked:
+            return False
+        return True
+
+
+def make_cursor(shard: int, flow_id: int) -> str:
+    return f"{shard}:{flow_id}"
+
+
+def parse_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        shard, flow_id = cursor.split(":", 1)
+        return int(shard), int(flow_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: '{cursor}'")
+
+
+def query_flows(
+    shards: List[List[FlowRecord]],
+    flt: FlowFilter,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    sort: Optional[str] = None,
+) -> Tuple[List[FlowRecord], Optional[str]]:
+    """
+    One page of matching flows and the cursor for the next page.
+
+    Pages are ordered by (shard, flow id), so a cursor stays valid while
+    the tables churn; flows created in shards already paged past are not
+    revisited. With `sort`, returns the top `limit` flows by that key
+    and no cursor. Either way only the page is materialized: selection
+    is a bounded heap over the matching flows.
+    """
+    if sort is not None:
+        key = SORT_KEYS[sort]
+        matched = (conn for records in shards for conn in records if flt.matches(conn))
+        return heapq.nlargest(limit, matched, key=key), None
+
+    after = parse_cursor(cursor) if cursor else (-1, 0)
+
+    def candidates():
+        for shard, records in enumerate(shards):
+            if shard < after[0]:
+                continue
+            for conn in records:
+                position = (shard, conn.flow_id)
+                if position > after and flt.matches(conn):
+                    yield position, conn
+
+    page = heapq.nsmallest(limit + 1, candidates(), key=itemgetter(0))
+
+    next_cursor = make_cursor(*page[limit - 1][0]) if len(page) > limit else None
+    return [conn for _, conn in page[:limit]], next_cursor
+
+
+async def stream_flows(
+    shards: List[List[FlowRecord]],
+    flt: FlowFilter,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> AsyncIterator[str]:
+    """
+    Matching flows as NDJSON, serialized `chunk_size` lines at a time.
+
+    `shards` are shallow record-list snapshots, so memory stays at one
+    reference per flow plus one chunk of text.
+    """
+    lines: List[str] = []
+
+    for records in shards:
+        for conn in records:
+            if not flt.matches(conn):
+                continue
+            lines.append(json.dumps(conn.to_dict()))
+            if len(lines) >= chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+
+    if lines:
+        yield "\n".join(lines) + "\n"
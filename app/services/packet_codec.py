@@ -0,0 +1,251 @@
+"""
+Fixed-layout packet and verdict records for shared-memory rings.
+
+Packet record (little-endian, PACKET_RECORD_SIZE bytes):
+
+    u64   sequence number (echoed in the verdict)
+    16B   source address (IPv4 as ::ffff:a.b.c.d)
+    16B   destination address
+    u16   source port
+    u16   destination port
+    u32   packet size
+    u8    protocol (0 TCP, 1 UDP, 2 ICMP)
+    u8    TCP flags
+    u8    outbound (0/1)
+    u8    app type hint (index into AppType)
+    u8    domain length (0 = none)
+    253B  domain (ASCII)
+
+Verdict record (VERDICT_RECORD_SIZE bytes):
+
+    u64   sequence number
+    u8    action (0 ALLOW, 1 DROP, 2 ERROR: the packet could not be processed)
+
+Wire record (binary ingest listener), framed as a u16 length followed by
+that many bytes, little-endian:
+
+    u8    address family (4 or 6)
+    u8    protocol (0 TCP, 1 UDP, 2 ICMP)
+    u8    TCP flags (0 unless TCP)
+    u8    direction (1 outbound, 0 inbound)
+    u16   source port
+    u16   destination port
+    u32   packet size
+    4/16B source address
+    4/16B destination address
+    ...   domain (ASCII, optional: the rest of the frame)
+
+An IPv4 record without a domain is 20 bytes, 22 framed. Verdicts go back
+as one byte per record, in arrival order: 0 forwarded, 1 dropped,
+2 invalid record.
+"""
+import re
+import socket
+import struct
+from typing import List, Optional, Tuple
+
+from app.schema.connection_schema import AppType, FiveTupleSchema, Protocol
+from app.schema.packet_schema import PacketSchema
+
+
+_PACKET = struct.Struct("<Q16s16sHHIBBBBB253s")
+_VERDICT = struct.Struct("<QB7x")
+
+PACKET_RECORD_SIZE = 320
+VERDICT_RECORD_SIZE = _VERDICT.size
+
+_PROTOCOLS = list(Protocol)
+_PROTOCOL_CODES = {p: i for i, p in enumerate(_PROTOCOLS)}
+_APPS = list(AppType)
+_APP_CODES = {a: i for i, a in enumerate(_APPS)}
+
+_ACTIONS = ("ALLOW", "DROP", "ERROR")
+_ACTION_CODES = {a: i for i, a in enumerate(_ACTIONS)}
+
+_V4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+
+def pack_address(ip: str) -> bytes:
+    """16-byte form of an address; IPv4 is stored IPv4-mapped."""
+    try:
+        if ":" in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return _V4_MAPPED_PREFIX + socket.inet_aton(ip)
+    except OSError:
+        return bytes(16)
+
+
+def unpack_address(packed: bytes) -> str:
+    if packed[:12] == _V4_MAPPED_PREFIX:
+        return socket.inet_ntoa(packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def pack_packet_into(buf, offset: int, seq: int, packet: PacketSchema):
+    t = packet.tuple
+    domain = packet.domain.encode("ascii") if packet.domain else b""
+    _PACKET.pack_into(
+        buf, offset,
+        seq,
+        pack_address(t.src_ip),
+        pack_address(t.dst_ip),
+        t.src_port,
+        t.dst_port,
+        packet.size,
+        _PROTOCOL_CODES[t.protocol],
+        packet.tcp_flags or 0,
+        1 if packet.outbound else 0,
+        _APP_CODES.get(packet.app_type, 0),
+        len(domain),
+        domain,
+    )
+
+
+def unpack_packet(buf, offset: int) -> Tuple[int, PacketSchema]:
+    (
+        seq, src, dst, src_port, dst_port, size,
+        protocol, tcp_flags, outbound, app, domain_len, domain,
+    ) = _PACKET.unpack_from(buf, offset)
+
+    # Validated before it was enqueued; skip re-validation
+    packet = PacketSchema.model_construct(
+        tuple=FiveTupleSchema.model_construct(
+            src_ip=unpack_address(src),
+            dst_ip=unpack_address(dst),
+            src_port=src_port,
+            dst_port=dst_port,
+            protocol=_PROTOCOLS[protocol],
+        ),
+        size=size,
+        outbound=bool(outbound),
+        tcp_flags=tcp_flags,
+        payload_length=0,
+        domain=domain[:domain_len].decode("ascii") if domain_len else None,
+        app_type=_APPS[app],
+    )
+    return seq, packet
+
+
+def pack_verdict_into(buf, offset: int, seq: int, action: str):
+    _VERDICT.pack_into(buf, offset, seq, _ACTION_CODES[action])
+
+
+def unpack_verdict(buf, offset: int) -> Tuple[int, str]:
+    seq, action = _VERDICT.unpack_from(buf, offset)
+    return seq, _ACTIONS[action]
+
+
+# =================================================
+# Wire records
+# =================================================
+
+_WIRE_HEADER = struct.Struct("<BBBBHHI")
+_WIRE_FRAME = struct.Struct("<H")
+_ADDRESS_SIZES = {4: 4, 6: 16}
+_DOMAIN = re.compile(r"^(?:[a-zA-Z0-9-]{1,63}\.)+[a-zA-Z]{2,}$")
+
+MAX_WIRE_RECORD = _WIRE_HEADER.size + 32 + 253
+
+WIRE_FORWARDED = 0
+WIRE_DROPPED = 1
+WIRE_INVALID = 2
+
+
+def encode_wire_frame(packet: PacketSchema) -> bytes:
+    t = packet.tuple
+    if ":" in t.src_ip:
+        family = 6
+        src = socket.inet_pton(socket.AF_INET6, t.src_ip)
+        dst = socket.inet_pton(socket.AF_INET6, t.dst_ip)
+    else:
+        family = 4
+        src = socket.inet_aton(t.src_ip)
+        dst = socket.inet_aton(t.dst_ip)
+
+    record = _WIRE_HEADER.pack(
+        family,
+        _PROTOCOL_CODES[t.protocol],
+        packet.tcp_flags or 0,
+        1 if packet.outbound else 0,
+        t.src_port,
+        t.dst_port,
+        packet.size,
+    ) + src + dst + (packet.domain.encode("ascii") if packet.domain else b"")
+    return _WIRE_FRAME.pack(len(record)) + record
+
+
+def split_wire_frames(buf) -> Tuple[List[bytes], int]:
+    """
+    Complete frames at the start of `buf` and the number of bytes they
+    use. Parsing stops before a frame length no valid record can have;
+    if that frame comes first, raises ValueError.
+    """
+    frames: List[bytes] = []
+    offset = 0
+    end = len(buf)
+    prefix = _WIRE_FRAME.size
+
+    while end - offset >= prefix:
+        (length,) = _WIRE_FRAME.unpack_from(buf, offset)
+        if not _WIRE_HEADER.size <= length <= MAX_WIRE_RECORD:
+            if frames:
+                break
+            raise ValueError(f"Invalid frame length {length}")
+        if end - offset - prefix < length:
+            break
+        start = offset + prefix
+        frames.append(bytes(buf[start:start + length]))
+        offset = start + length
+
+    return frames, offset
+
+
+def decode_wire_record(record: bytes) -> Optional[PacketSchema]:
+    """The packet in a wire record, or None if the record is invalid."""
+    try:
+        family, protocol, tcp_flags, outbound, src_port, dst_port, size = _WIRE_HEADER.unpack_from(record)
+        address_size = _ADDRESS_SIZES[family]
+        protocol = _PROTOCOLS[protocol]
+    except (struct.error, KeyError, IndexError):
+        return None
+
+    domain_start = _WIRE_HEADER.size + 2 * address_size
+    if len(record) < domain_start or size == 0:
+        return None
+    if src_port == 0 or dst_port == 0 or outbound > 1:
+        return None
+    if tcp_flags and protocol != Protocol.TCP:
+        return None
+
+    src = record[_WIRE_HEADER.size:_WIRE_HEADER.size + address_size]
+    dst = record[_WIRE_HEADER.size + address_size:domain_start]
+    if family == 4:
+        src_ip, dst_ip = socket.inet_ntoa(src), socket.inet_ntoa(dst)
+    else:
+        src_ip, dst_ip = socket.inet_ntop(socket.AF_INET6, src), socket.inet_ntop(socket.AF_INET6, dst)
+
+    domain = None
+    if len(record) > domain_start:
+        try:
+            domain = record[domain_start:].decode("ascii")
+        except UnicodeDecodeError:
+            return None
+        if not 3 <= len(domain) <= 253 or not _DOMAIN.match(domain):
+            return None
+
+    # Same constraints as PacketSchema, checked above without pydantic
+    return PacketSchema.model_construct(
+        tuple=FiveTupleSchema.model_construct(
+            src_ip=src_ip,
+            dst_ip=dst_ip,
+            src_port=src_port,
+            dst_port=dst_port,
+            protocol=protocol,
+        ),
+        size=size,
+        outbound=bool(outbound),
+        tcp_flags=tcp_flags,
+        payload_length=0,
+        domain=domain,
+        app_type=AppType.UNKNOWN,
+    )
@@ -1,19 +1,37 @@
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 from app.services.pcap_reader_service import PcapReader
 from app.services.packet_parser_service import PacketParser
 from app.services.extractors_service import ExtractorService
+from app.services.cardinality_service import CardinalityStats
 from app.services.classification_service import ClassificationService
-from app.services.rule_service import RuleService
+from app.services.flow_export_service import END_OF_CAPTURE, FlowExportRecord, FlowExportService
+from app.services.rule_service import RuleQuery, RuleService
+from app.services.rule_stats_service import rule_key
+from app.services.top_talkers_service import TopTalkers
+from app.schema.connection_schema import AppType
 from app.schema.pcap_report_schema import PcapAnalysisReport, ConnectionDetail
 
 
+# Packets whose rule checks are resolved together
+RULE_BATCH_SIZE = 256
+
+# Domains listed by name in the report; all are counted in `distinct`
+MAX_DOMAINS_LISTED = 1000
+
+
 class PcapProcessor:
 
-    def __init__(self):
+    def __init__(
+        self,
+        classifier: ClassificationService | None = None,
+        rule_service: RuleService | None = None,
+        flow_exporter: FlowExportService | None = None,
+    ):
         self.parser = PacketParser()
         self.extractor = ExtractorService()
-        self.classifier = ClassificationService()
-        self.rule_service = RuleService()
+        self.classifier = classifier or ClassificationService()
+        self.rule_service = rule_service or RuleService()
+        self.flow_exporter = flow_exporter
 
     async def analyze(self, pcap_path: str) -> PcapAnalysisReport:
 
@@ -22,6 +40,8 @@ class PcapProcessor:
             raise ValueError(f"Failed to open PCAP file: {pcap_path}")
 
         flows: Dict[Tuple, ConnectionDetail] = {}
+        # Capture timestamps per flow: [first, last]
+        flow_times: Dict[Tuple, List[float]] = {}
 
         total_packets = 0
         tcp_packets = 0
@@ -32,6 +52,31 @@ class PcapProcessor:
         dropped = 0
         domains_detected = set()
         app_breakdown: Dict[str, int] = {}
+        top_talkers = TopTalkers()
+        cardinality = CardinalityStats()
+
+        # Rule checks are deferred and resolved per batch. The query
+        # captures the flow's state at that packet, so the verdict is the
+        # same as checking inline.
+        pending_flows: List[ConnectionDetail] = []
+        pending_queries: List[RuleQuery] = []
+        pending_sizes: List[int] = []
+
+        async def resolve_pending():
+            nonlocal forwarded, dropped
+
+            verdicts = await self.rule_service.should_block_many(pending_queries)
+            for pending_flow, size, block_reason in zip(pending_flows, pending_sizes, verdicts):
+                if block_reason:
+                    pending_flow.blocked = True
+                    self.rule_service.hits.record(rule_key(block_reason), size)
+                    dropped += 1
+                else:
+                    forwarded += 1
+
+            pending_flows.clear()
+            pending_queries.clear()
+            pending_sizes.clear()
 
         MAX_PACKETS = 1000
         while True:
@@ -80,7 +125,9 @@ class PcapProcessor:
             flow_key = (*left, *right, protocol_str)
 
             # Step 3: Get or create flow
+            ts = raw.header.ts_sec + raw.header.ts_usec / 1e6
             if flow_key not in flows:
+                flow_times[flow_key] = [ts, ts]
                 flows[flow_key] = ConnectionDetail(
                     src_ip=parsed.src_ip or "0.0.0.0",
                     dst_ip=parsed.dest_ip or "0.0.0.0",
@@ -88,12 +135,20 @@ class PcapProcessor:
                     dst_port=parsed.dest_port or 0,
                     protocol=protocol_str,
                 )
+            else:
+                flow_times[flow_key][1] = ts
 
             flow = flows[flow_key]
             flow.packets += 1
             flow.bytes += len(raw.data)
 
-            # Step 4: Extract domain
+            # Step 4: Classify by address range (no payload needed)
+            if flow.app_type == "UNKNOWN":
+                app_type = self.classifier.ip_to_app(parsed.dest_ip, parsed.src_ip)
+                if app_type != AppType.UNKNOWN:
+                    flow.app_type = app_type.value
+
+            # Step 5: Extract domain
             if parsed.payload and len(parsed.payload) > 0:
                 domain = None
 
@@ -108,33 +163,56 @@ class PcapProcessor:
 
                 if domain:
                     flow.domain = domain
-                    domains_detected.add(domain)
+                    cardinality.record_domain(domain)
+                    if len(domains_detected) < MAX_DOMAINS_LISTED:
+                        domains_detected.add(domain)
 
-            # Step 5: Classify app
+            # Step 6: Classify app
             if flow.domain and flow.app_type == "UNKNOWN":
                 app_type = self.classifier.sni_to_app(flow.domain)
                 flow.app_type = app_type.value
 
-            # Step 6: Check blocking rules
-            block_reason = await self.rule_service.should_block(
+            # Heavy hitters (per packet direction; flows by first packet)
+            top_talkers.record(
+                parsed.src_ip,
+                parsed.dest_ip,
+                (flow.src_ip, flow.src_port, flow.dst_ip, flow.dst_port, flow.protocol),
+                len(raw.data),
+                flow.domain,
+            )
+
+            # Step 7: Queue blocking rule check
+            pending_flows.append(flow)
+            pending_sizes.append(len(raw.data))
+            pending_queries.append(RuleQuery(
                 src_ip=flow.src_ip,
                 dst_port=flow.dst_port,
                 app=flow.app_type,
                 domain=flow.domain,
-            )
+            ))
 
-            if block_reason:
-                flow.blocked = True
-                dropped += 1
-            else:
-                forwarded += 1
+            if len(pending_queries) >= RULE_BATCH_SIZE:
+                await resolve_pending()
 
         reader.close()
 
+        if pending_queries:
+            await resolve_pending()
+
+        if self.flow_exporter:
+            await self._export_flows(flows, flow_times)
+
         for flow in flows.values():
             app = flow.app_type
             app_breakdown[app] = app_breakdown.get(app, 0) + flow.packets
 
+            label = f"{flow.src_ip}:{flow.src_port}-{flow.dst_ip}:{flow.dst_port}/{flow.protocol}"
+            cardinality.record_flow(flow.src_ip, flow.dst_ip, label, flow.domain)
+            if app != AppType.UNKNOWN.value:
+                cardinality.record_app(app, flow.src_ip, flow.dst_ip, label, flow.domain)
+
+        distinct = cardinality.report()
+
         all_connections = list(flows.values())
         blocked_connections = [c for c in all_connections if c.blocked]
 
@@ -148,6 +226,32 @@ class PcapProcessor:
             other_packets=other_packets,
             app_breakdown=app_breakdown,
             domains_detected=sorted(domains_detected),
+            distinct=distinct["distinct"],
+            distinct_per_app=distinct["per_app"],
+            top_talkers=top_talkers.report_all(),
             blocked_connections=blocked_connections,
             connections=all_connections,
-        )
\ No newline at end of file
+        )
+
+    async def _export_flows(self, flows: Dict[Tuple, ConnectionDetail], flow_times: Dict[Tuple, List[float]]):
+        for flow_key, flow in flows.items():
+            start, end = flow_times[flow_key]
+            self.flow_exporter.offer(FlowExportRecord(
+                start=start,
+                end=end,
+                src_ip=flow.src_ip,
+                dst_ip=flow.dst_ip,
+                src_port=flow.src_port,
+                dst_port=flow.dst_port,
+                protocol=flow.protocol,
+                app=flow.app_type,
+                domain=flow.domain,
+                packets=flow.packets,
+                bytes=flow.bytes,
+                blocked=flow.blocked,
+                end_reason=END_OF_CAPTURE,
+            ))
+            if self.flow_exporter.is_backlogged():
+                await self.flow_exporter.drain()
+
+        await self.flow_exporter.flush()
@@ -0,0 +1,147 @@
+import csv
+import io
+import ipaddress
+import json
+import re
+from typing import Dict, List, Optional, Set, Tuple
+from app.schema.connection_schema import AppType
+
+
+RULE_TYPES = ("ip", "cidr", "domain", "app", "port")
+
+_DOMAIN_RE = re.compile(r"^(?:\*\.)?(?:[a-z0-9-]{1,63}\.)*[a-z0-9-]{1,63}$")
+_APP_NAMES = {app.value for app in AppType}
+
+# Rejected lines echoed back to the caller
+MAX_REJECTED_SAMPLES = 20
+
+
+def normalize_rule(rule_type: str, value: str) -> str:
+    """
+    Validate one rule and return it in the form stored in Redis.
+    Raises ValueError for unknown types or malformed values.
+    """
+    rule_type = rule_type.strip().lower()
+    value = str(value).strip()
+
+    if rule_type == "ip":
+        return str(ipaddress.ip_address(value))
+
+    if rule_type == "cidr":
+        return str(ipaddress.ip_network(value, strict=False))
+
+    if rule_type == "domain":
+        value = value.lower().rstrip(".")
+        if not _DOMAIN_RE.match(value):
+            raise ValueError(f"Invalid domain rule: '{value}'")
+        return value
+
+    if rule_type == "app":
+        value = value.upper()
+        if value not in _APP_NAMES:
+            raise ValueError(f"Unknown app: '{value}'")
+        return value
+
+    if rule_type == "port":
+        port = int(value)
+        if not 0 <= port <= 65535:
+            raise ValueError(f"Port out of range: {port}")
+        return str(port)
+
+    raise ValueError(f"Unknown rule type: '{rule_type}'")
+
+
+def detect_format(content_type: Optional[str] = None, filename: Optional[str] = None) -> str:
+    content_type = (content_type or "").lower()
+    filename = (filename or "").lower()
+
+    if "json" in content_type or filename.endswith(".json"):
+        return "json"
+    if "csv" in content_type or filename.endswith(".csv"):
+        return "csv"
+    return "text"
+
+
+def parse_rules(
+    data: str,
+    fmt: str = "text",
+    default_type: Optional[str] = None,
+) -> Tuple[Dict[str, Set[str]], List[str], int]:
+    """
+    Parse a bulk rule list.
+
+    - text: one rule per line, either "<type>,<value>" or a bare value
+      when `default_type` is given. Blank lines and '#' comments skipped.
+    - csv:  rows of type,value (a "type,value" header row is allowed).
+    - json: {"<type>": [values...]} or [{"type": ..., "value": ...}].
+      An empty list is kept, so a replace import can clear that type.
+
+    A type appears in the result only with at least one valid rule or an
+    explicit empty JSON list. Returns (rules by type, sample of rejected entries, rejected count).
+    """
+    rules: Dict[str, Set[str]] = {}
+    rejected: List[str] = []
+    rejected_count = 0
+
+    def accept(rule_type: Optional[str], value) -> None:
+        nonlocal rejected_count
+        try:
+            if not rule_type:
+                raise ValueError("Missing rule type")
+            if not isinstance(rule_type, str):
+                raise TypeError("Rule type must be a string")
+            rule_type = rule_type.strip().lower()
+            rule = normalize_rule(rule_type, value)
+            # Only a valid row creates its type's entry
+            rules.setdefault(rule_type, set()).add(rule)
+        except (ValueError, TypeError):
+            rejected_count += 1
+            if len(rejected) < MAX_REJECTED_SAMPLES:
+                rejected.append(f"{rule_type},{value}" if rule_type else str(value))
+
+    if fmt == "json":
+        payload = json.loads(data)
+
+        if isinstance(payload, dict):
+            for rule_type, values in payload.items():
+                if rule_type.strip().lower() not in RULE_TYPES:
+                    raise ValueError(f"Unknown rule type: '{rule_type}'")
+                if values == []:
+                    # An explicit empty list: with replace, clears the type
+                    rules.setdefault(rule_type.strip().lower(), set())
+                for value in values if isinstance(values, list) else [values]:
+                    accept(rule_type, value)
+
+        elif isinstance(payload, list):
+            for item in payload:
+                if isinstance(item, dict):
+                    accept(item.get("type") or default_type, item.get("value"))
+                else:
+                    accept(default_type, item)
+
+        else:
+            raise ValueError("JSON rules must be an object or an array")
+
+    elif fmt == "csv":
+        for row in csv.reader(io.StringIO(data)):
+            if not row or row[0].strip().startswith("#"):
+                continue
+            if len(row) == 1:
+                accept(default_type, row[0])
+            elif row[0].strip().lower() == "type":
+                continue
+            else:
+                accept(row[0], row[1])
+
+    else:
+        for line in data.splitlines():
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if "," in line:
+                rule_type, value = line.split(",", 1)
+                accept(rule_type, value)
+            else:
+                accept(default_type, line)
+
+    return rules, rejected, rejected_count
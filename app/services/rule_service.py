@@ -1,70 +1,481 @@
-from typing import Optional
+import asyncio
+import ipaddress
+import time
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from redis.exceptions import WatchError
 from app.cache.redis import redis_client
 from app.schema.rule_schema import BlockReasonSchema, BlockType
+from app.services.rule_snapshot import RuleSnapshot
+from app.services.rule_stats_service import RuleStatsService
+from app.utils.domain_trie import domain_candidates
+from app.utils.prefix_table import PrefixTable
+from app.utils.timing_wheel import TimingWheel
+
+
+# Bumped on every rule mutation; the new value is published on the
+# channel so every process rebuilds its local snapshot.
+RULES_VERSION_KEY = "rules:version"
+RULES_CHANNEL = "rules:invalidate"
+# Sorted set of "<type>:<value>" -> expiry deadline (epoch seconds)
+RULES_EXPIRY_KEY = "rules:expiry"
+
+# Rule type -> Redis set holding it
+RULE_SETS: Dict[str, str] = {
+    "ip": "blocked:ips",
+    "cidr": "blocked:cidrs",
+    "domain": "blocked:domains",
+    "app": "blocked:apps",
+    "port": "blocked:ports",
+}
+
+# Members per SADD / pipeline round trip during bulk imports
+IMPORT_CHUNK_SIZE = 10000
+IMPORT_CHUNKS_PER_PIPELINE = 10
+# Leftover staging sets from a crashed import expire on their own
+STAGING_TTL_SECONDS = 3600
+
+
+class RuleQuery(NamedTuple):
+    """
+    One packet's inputs to should_block / should_block_many. IP and CIDR
+    rules match either address; a flow-level check passes both ends.
+    """
+    src_ip: str
+    dst_port: int
+    app: str
+    domain: str | None = None
+    dst_ip: str | None = None
 
 
 class RuleService:
+    """
+    Blocking rules stored in Redis sets.
+
+    Once started, packet checks run against an in-process RuleSnapshot
+    that is rebuilt whenever a mutation is announced on RULES_CHANNEL.
+    Before start() the checks fall back to querying Redis directly.
+
+    Rules added with a ttl get a deadline in RULES_EXPIRY_KEY; every
+    process mirrors those deadlines in a local timing wheel and removes
+    rules as they come due, bumping the ruleset version like any other
+    mutation.
+    """
+
+    def __init__(self):
+        self.snapshot: Optional[RuleSnapshot] = None
+        self._epoch = 0
+        self.hits = RuleStatsService()
+        self._listener: Optional[asyncio.Task] = None
+        self._expirer: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+        self._expiry: TimingWheel[str] = TimingWheel(tick=1.0, num_slots=3600, now=time.time())
+        # (ruleset version, table) for CIDR checks made without a snapshot
+        self._cidr_cache: Optional[Tuple[int, PrefixTable[str]]] = None
+
+    # ==============================
+    # Lifecycle
+    # ==============================
+
+    async def start(self):
+        await self.refresh()
+        if not self._listener or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        if not self._expirer or self._expirer.done():
+            self._expirer = asyncio.create_task(self._expire_loop())
+        await self.hits.start()
+
+    async def stop(self):
+        for task in (self._listener, self._expirer):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._listener = None
+        self._expirer = None
+        try:
+            await self.hits.stop()
+        except Exception:
+            pass
+
+    @property
+    def version(self) -> Optional[int]:
+        return self.snapshot.version if self.snapshot else None
+
+    @property
+    def epoch(self) -> Optional[int]:
+        """
+        Local ruleset epoch, bumped on every snapshot swap. Verdicts
+        cached under an older epoch are stale. None while there is no
+        snapshot, in which case nothing may be cached.
+        """
+        return self._epoch if self.snapshot is not None else None
+
+    # ==============================
+    # Snapshot Management
+    # ==============================
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            pipe = redis_client().pipeline(transaction=True)
+            pipe.get(RULES_VERSION_KEY)
+            pipe.smembers("blocked:ips")
+            pipe.smembers("blocked:cidrs")
+            pipe.smembers("blocked:ports")
+            pipe.smembers("blocked:apps")
+            pipe.smembers("blocked:domains")
+            pipe.zrange(RULES_EXPIRY_KEY, 0, -1, withscores=True)
+            version, ips, cidrs, ports, apps, domains, expiring = await pipe.execute()
+
+            self.snapshot = RuleSnapshot(
+                version=int(version or 0),
+                ips=ips,
+                cidrs=cidrs,
+                ports=ports,
+                apps=apps,
+                domains=domains,
+            )
+            self._epoch += 1
+
+            self._expiry.clear()
+            for member, deadline in expiring:
+                self._expiry.schedule(member, deadline)
+
+    async def _listen(self):
+        while True:
+            pubsub = redis_client().pubsub()
+            try:
+                await pubsub.subscribe(RULES_CHANNEL)
+                # Catch up on anything published while (re)subscribing
+                await self.refresh()
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if self.snapshot and int(message["data"]) <= self.snapshot.version:
+                        continue
+                    await self.refresh()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def _mutate(self, rule_type: str, member: str, add: bool, ttl: Optional[int] = None):
+        key = RULE_SETS[rule_type]
+        expiry_member = f"{rule_type}:{member}"
+
+        pipe = redis_client().pipeline(transaction=True)
+        if add:
+            pipe.sadd(key, member)
+            if ttl:
+                pipe.zadd(RULES_EXPIRY_KEY, {expiry_member: time.time() + ttl})
+            else:
+                # A permanent block cancels any pending expiry
+                pipe.zrem(RULES_EXPIRY_KEY, expiry_member)
+        else:
+            pipe.srem(key, member)
+            pipe.zrem(RULES_EXPIRY_KEY, expiry_member)
+        pipe.incr(RULES_VERSION_KEY)
+        version = (await pipe.execute())[-1]
+
+        await self._announce(version)
+
+    async def _announce(self, version: int):
+        await redis_client().publish(RULES_CHANNEL, version)
+
+        # Read-your-writes for the process that made the change
+        if self.snapshot is not None:
+            await self.refresh()
+
+    # ==============================
+    # Rule Expiry
+    # ==============================
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(self._expiry.tick)
+
+            due = self._expiry.advance(time.time())
+            if not due:
+                continue
+
+            try:
+                await self._expire(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Retry on the next tick
+                for member in due:
+                    self._expiry.schedule(member, time.time())
+
+    async def _expire(self, members: List[str]):
+        """
+        Remove due rules. WATCH on the expiry index makes the removal
+        safe against renewals and against other processes expiring the
+        same rules at the same moment.
+        """
+        now = time.time()
+
+        async with redis_client().pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(RULES_EXPIRY_KEY)
+                deadlines = await pipe.zmscore(RULES_EXPIRY_KEY, members)
+
+                expired = [
+                    member for member, deadline in zip(members, deadlines)
+                    if deadline is not None and deadline <= now
+                ]
+                if not expired:
+                    return
+
+                pipe.multi()
+                pipe.zrem(RULES_EXPIRY_KEY, *expired)
+                for member in expired:
+                    rule_type, value = member.split(":", 1)
+                    pipe.srem(RULE_SETS[rule_type], value)
+                pipe.incr(RULES_VERSION_KEY)
+                version = (await pipe.execute())[-1]
+
+            except WatchError:
+                # Someone else touched the index first; look again next tick
+                for member in members:
+                    self._expiry.schedule(member, now)
+                return
+
+        await self._announce(version)
+
+    # ==============================
+    # Bulk Import / Export
+    # ==============================
+
+    async def import_rules(
+        self,
+        rules: Dict[str, Iterable[str]],
+        replace: bool = False,
+    ) -> Dict[str, int]:
+        """
+        Apply a large rule list as one versioned, atomic ruleset change.
+
+        The new members of each affected set are built in a staging key
+        through chunked, pipelined SADDs. A single MULTI/EXEC then merges
+        every staging key into its live set (SUNIONSTORE; RENAME over it
+        with `replace`) and bumps the version. Readers see either the old
+        or the new ruleset, never a partial import, and rules added or
+        expired while the import runs are kept. Imported rules are permanent:
+        pending expiries for them (and, with `replace`, for every rule of
+        a replaced type) are dropped. Returns members per type.
+
+        Only the types present in `rules` are touched; an empty value list
+        with `replace` clears that type. Raises ValueError for unknown
+        types.
+        """
+        unknown = [rule_type for rule_type in rules if rule_type not in RULE_SETS]
+        if unknown:
+            raise ValueError(f"Unknown rule type(s): {', '.join(map(repr, unknown))}")
+        if not rules:
+            return {}
+
+        client = redis_client()
+        tag = await client.incr("rules:import:seq")
+
+        staged: Dict[str, str] = {}
+        imported: Dict[str, set] = {}
+        counts: Dict[str, int] = {}
+
+        for rule_type, values in rules.items():
+            key = RULE_SETS[rule_type]
+            staging = f"{key}:staging:{tag}"
+            staged[rule_type] = staging
+
+            values = list(values)
+            imported[rule_type] = set(values)
+            pipe = client.pipeline(transaction=False)
+            queued = 0
+
+            for i in range(0, len(values), IMPORT_CHUNK_SIZE):
+                pipe.sadd(staging, *values[i:i + IMPORT_CHUNK_SIZE])
+                pipe.expire(staging, STAGING_TTL_SECONDS)
+                queued += 1
+                if queued >= IMPORT_CHUNKS_PER_PIPELINE:
+                    await pipe.execute()
+                    queued = 0
+
+            if queued:
+                await pipe.execute()
+
+        pipe = client.pipeline(transaction=False)
+        for staging in staged.values():
+            pipe.exists(staging)
+        pipe.zrange(RULES_EXPIRY_KEY, 0, -1)
+        *staging_present, expiring = await pipe.execute()
+
+        stale_expiries = []
+        for member in expiring:
+            rule_type, value = member.split(":", 1)
+            if rule_type in imported and (replace or value in imported[rule_type]):
+                stale_expiries.append(member)
+
+        pipe = client.pipeline(transaction=True)
+        for (rule_type, staging), present in zip(staged.items(), staging_present):
+            key = RULE_SETS[rule_type]
+            if not present:
+                # Nothing staged: the caller imported an empty list
+                if replace:
+                    pipe.delete(key)
+            elif replace:
+                pipe.rename(staging, key)
+                pipe.persist(key)
+            else:
+                # Merged here, not up front, so concurrent writes survive
+                pipe.sunionstore(key, [key, staging])
+                pipe.delete(staging)
+        if stale_expiries:
+            pipe.zrem(RULES_EXPIRY_KEY, *stale_expiries)
+        for key in (RULE_SETS[t] for t in staged):
+            pipe.scard(key)
+        pipe.incr(RULES_VERSION_KEY)
+        results = await pipe.execute()
+
+        version = results[-1]
+        for rule_type, size in zip(staged, results[-1 - len(staged):-1]):
+            counts[rule_type] = size
+
+        await self._announce(version)
+
+        return counts
+
+    async def export_rules(self) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Stream every rule as (type, value) using SSCAN, without loading
+        whole sets into memory.
+        """
+        client = redis_client()
+        for rule_type, key in RULE_SETS.items():
+            async for member in client.sscan_iter(key, count=1000):
+                yield rule_type, member
 
     # ==============================
     # IP Rules
     # ==============================
 
-    async def block_ip(self, ip: str):
-        await redis_client().sadd("blocked:ips", ip)
+    async def block_ip(self, ip: str, ttl: Optional[int] = None):
+        await self._mutate("ip", ip, add=True, ttl=ttl)
 
     async def unblock_ip(self, ip: str):
-        await redis_client().srem("blocked:ips", ip)
+        await self._mutate("ip", ip, add=False)
 
     async def is_ip_blocked(self, ip: str) -> bool:
+        if self.snapshot is not None:
+            return self.snapshot.is_ip_blocked(ip)
         return await redis_client().sismember("blocked:ips", ip)
 
+    # ==============================
+    # CIDR Rules (IPv4 / IPv6 prefixes)
+    # ==============================
+
+    @staticmethod
+    def _normalize_prefix(prefix: str) -> str:
+        # Raises ValueError for anything that is not an IP prefix
+        return str(ipaddress.ip_network(prefix.strip(), strict=False))
+
+    async def block_cidr(self, prefix: str, ttl: Optional[int] = None):
+        await self._mutate("cidr", self._normalize_prefix(prefix), add=True, ttl=ttl)
+
+    async def unblock_cidr(self, prefix: str):
+        await self._mutate("cidr", self._normalize_prefix(prefix), add=False)
+
+    async def match_cidr(self, ip: str) -> Optional[str]:
+        """
+        Return the longest blocked prefix containing `ip`, if any.
+        """
+        if self.snapshot is not None:
+            return self.snapshot.match_cidr(ip)
+
+        table = await self._fallback_cidr_table(await redis_client().get(RULES_VERSION_KEY))
+        return table.lookup(ip)
+
+    async def _fallback_cidr_table(self, version) -> PrefixTable[str]:
+        """
+        Prefix table of blocked:cidrs, rebuilt only when the ruleset
+        version has moved since the last build.
+        """
+        version = int(version or 0)
+        if self._cidr_cache is not None and self._cidr_cache[0] == version:
+            return self._cidr_cache[1]
+
+        table: PrefixTable[str] = PrefixTable()
+        for prefix in await redis_client().smembers("blocked:cidrs"):
+            table.add(prefix, prefix)
+        table.build()
+        self._cidr_cache = (version, table)
+        return table
+
     # ==============================
     # App Rules
     # ==============================
 
-    async def block_app(self, app: str):
-        await redis_client().sadd("blocked:apps", app)
+    async def block_app(self, app: str, ttl: Optional[int] = None):
+        await self._mutate("app", app, add=True, ttl=ttl)
 
     async def unblock_app(self, app: str):
-        await redis_client().srem("blocked:apps", app)
+        await self._mutate("app", app, add=False)
 
     async def is_app_blocked(self, app: str) -> bool:
+        if self.snapshot is not None:
+            return self.snapshot.is_app_blocked(app)
         return await redis_client().sismember("blocked:apps", app)
 
     # ==============================
     # Domain Rules (supports wildcard)
     # ==============================
 
-    async def block_domain(self, domain: str):
-        await redis_client().sadd("blocked:domains", domain.lower())
+    async def block_domain(self, domain: str, ttl: Optional[int] = None):
+        await self._mutate("domain", domain.lower(), add=True, ttl=ttl)
 
     async def unblock_domain(self, domain: str):
-        await redis_client().srem("blocked:domains", domain.lower())
+        await self._mutate("domain", domain.lower(), add=False)
 
-    async def is_domain_blocked(self, domain: str) -> bool:
-        domain = domain.lower()
-        blocked = await redis_client().smembers("blocked:domains")
+    async def match_domain(self, domain: str) -> Optional[str]:
+        """
+        Return the rule that blocks `domain`, if any. Without a snapshot
+        only the candidate rules for the domain's suffixes are asked for,
+        never the whole set.
+        """
+        if self.snapshot is not None:
+            return self.snapshot.match_domain(domain)
+
+        candidates = domain_candidates(domain)
+        hits = await redis_client().smismember("blocked:domains", candidates)
+
+        for rule, hit in zip(candidates, hits):
+            if hit:
+                return rule
 
-        for rule in blocked:
-            if rule.startswith("*."):
-                if domain.endswith(rule[1:]):
-                    return True
-            elif rule == domain:
-                return True
+        return None
 
-        return False
+    async def is_domain_blocked(self, domain: str) -> bool:
+        return await self.match_domain(domain) is not None
 
     # ==============================
     # Port Rules
     # ==============================
 
-    async def block_port(self, port: int):
-        await redis_client().sadd("blocked:ports", str(port))
+    async def block_port(self, port: int, ttl: Optional[int] = None):
+        await self._mutate("port", str(port), add=True, ttl=ttl)
 
     async def unblock_port(self, port: int):
-        await redis_client().srem("blocked:ports", str(port))
+        await self._mutate("port", str(port), add=False)
 
     async def is_port_blocked(self, port: int) -> bool:
+        if self.snapshot is not None:
+            return self.snapshot.is_port_blocked(port)
         return await redis_client().sismember("blocked:ports", str(port))
 
     # ==============================
@@ -77,29 +488,143 @@ class RuleService:
         dst_port: int,
         app: str,
         domain: str | None,
+        dst_ip: str | None = None,
     ) -> Optional[BlockReasonSchema]:
 
-        if await self.is_ip_blocked(src_ip):
-            return BlockReasonSchema(type=BlockType.IP, detail=src_ip)
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot.check(src_ip, dst_port, app, domain, dst_ip)
+
+        endpoints = (src_ip, dst_ip) if dst_ip else (src_ip,)
+
+        for ip in endpoints:
+            if await self.is_ip_blocked(ip):
+                return BlockReasonSchema(type=BlockType.IP, detail=ip, rule=ip)
+
+        for ip in endpoints:
+            prefix = await self.match_cidr(ip)
+            if prefix:
+                return BlockReasonSchema(type=BlockType.CIDR, detail=ip, rule=prefix)
 
         if await self.is_port_blocked(dst_port):
-            return BlockReasonSchema(type=BlockType.PORT, detail=str(dst_port))
+            return BlockReasonSchema(type=BlockType.PORT, detail=str(dst_port), rule=str(dst_port))
 
         if await self.is_app_blocked(app):
-            return BlockReasonSchema(type=BlockType.APP, detail=app)
+            return BlockReasonSchema(type=BlockType.APP, detail=app, rule=app)
 
-        if domain and await self.is_domain_blocked(domain):
-            return BlockReasonSchema(type=BlockType.DOMAIN, detail=domain)
+        if domain:
+            rule = await self.match_domain(domain)
+            if rule:
+                return BlockReasonSchema(type=BlockType.DOMAIN, detail=domain, rule=rule)
 
         return None
-    
+
+    async def should_block_many(
+        self,
+        batch: Sequence[RuleQuery],
+    ) -> List[Optional[BlockReasonSchema]]:
+        """
+        Evaluate a batch of packets in one go. With a snapshot this is a
+        plain in-memory loop; otherwise the distinct keys of the whole
+        batch are resolved with one SMISMEMBER per set in a single
+        pipeline, i.e. one Redis round trip per batch.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return [snapshot.check(*query) for query in batch]
+
+        if not batch:
+            return []
+
+        ips = list({q.src_ip for q in batch} | {q.dst_ip for q in batch if q.dst_ip})
+        ports = list({str(q.dst_port) for q in batch})
+        apps = list({q.app for q in batch})
+
+        candidates_by_domain = {
+            q.domain: domain_candidates(q.domain)
+            for q in batch if q.domain
+        }
+        domain_rules = list({c for cs in candidates_by_domain.values() for c in cs})
+
+        pipe = redis_client().pipeline(transaction=False)
+        pipe.smismember("blocked:ips", ips)
+        pipe.get(RULES_VERSION_KEY)
+        pipe.smismember("blocked:ports", ports)
+        pipe.smismember("blocked:apps", apps)
+        if domain_rules:
+            pipe.smismember("blocked:domains", domain_rules)
+        results = await pipe.execute()
+
+        blocked_ips = {ip for ip, hit in zip(ips, results[0]) if hit}
+        blocked_ports = {port for port, hit in zip(ports, results[2]) if hit}
+        blocked_apps = {app for app, hit in zip(apps, results[3]) if hit}
+        blocked_domain_rules = (
+            {rule for rule, hit in zip(domain_rules, results[4]) if hit}
+            if domain_rules else set()
+        )
+
+        cidr_table = await self._fallback_cidr_table(results[1])
+        cidr_matches = {ip: cidr_table.lookup(ip) for ip in ips} if len(cidr_table) else {}
+
+        domain_matches: Dict[str, Optional[str]] = {
+            domain: next((c for c in candidates if c in blocked_domain_rules), None)
+            for domain, candidates in candidates_by_domain.items()
+        }
+
+        verdicts: List[Optional[BlockReasonSchema]] = []
+        for q in batch:
+            port = str(q.dst_port)
+            endpoints = (q.src_ip, q.dst_ip) if q.dst_ip else (q.src_ip,)
+            blocked_ip = next((ip for ip in endpoints if ip in blocked_ips), None)
+            cidr_ip = next((ip for ip in endpoints if cidr_matches.get(ip)), None)
+
+            if blocked_ip:
+                verdicts.append(BlockReasonSchema(type=BlockType.IP, detail=blocked_ip, rule=blocked_ip))
+            elif cidr_ip:
+                verdicts.append(BlockReasonSchema(
+                    type=BlockType.CIDR,
+                    detail=cidr_ip,
+                    rule=cidr_matches[cidr_ip],
+                ))
+            elif port in blocked_ports:
+                verdicts.append(BlockReasonSchema(type=BlockType.PORT, detail=port, rule=port))
+            elif q.app in blocked_apps:
+                verdicts.append(BlockReasonSchema(type=BlockType.APP, detail=q.app, rule=q.app))
+            elif q.domain and domain_matches.get(q.domain):
+                verdicts.append(BlockReasonSchema(
+                    type=BlockType.DOMAIN,
+                    detail=q.domain,
+                    rule=domain_matches[q.domain],
+                ))
+            else:
+                verdicts.append(None)
+
+        return verdicts
+
     # ==============================
     # Rule Reporting
     # ==============================
 
+    async def get_rule_stats(
+        self,
+        limit: int = 100,
+        include_unused: bool = False,
+        ascending: bool = False,
+    ):
+        rule_keys = None
+        if include_unused:
+            rule_keys = [
+                f"{rule_type.upper()}:{value}"
+                async for rule_type, value in self.export_rules()
+            ]
+        return await self.hits.get_stats(limit, rule_keys=rule_keys, ascending=ascending)
+
     async def get_blocked_ips(self):
         return list(await redis_client().smembers("blocked:ips"))
 
+    async def get_blocked_cidrs(self):
+        return list(await redis_client().smembers("blocked:cidrs"))
+
     async def get_blocked_apps(self):
         return list(await redis_client().smembers("blocked:apps"))
 
@@ -0,0 +1,99 @@
+from typing import Iterable, Optional
+from app.schema.rule_schema import BlockReasonSchema, BlockType
+from app.utils.domain_trie import DomainTrie
+from app.utils.prefix_table import PrefixTable
+
+
+class RuleSnapshot:
+    """
+    Immutable, in-process compiled view of the Redis rule sets.
+
+    A new snapshot is built on every ruleset change and swapped in as a
+    whole, so packet checks never touch Redis and never see a half
+    applied update.
+    """
+
+    __slots__ = ("version", "ips", "cidrs", "ports", "apps", "domains")
+
+    def __init__(
+        self,
+        version: int = 0,
+        ips: Iterable[str] = (),
+        cidrs: Iterable[str] = (),
+        ports: Iterable[str | int] = (),
+        apps: Iterable[str] = (),
+        domains: Iterable[str] = (),
+    ):
+        self.version = version
+        self.ips = frozenset(ips)
+        self.cidrs: PrefixTable[str] = PrefixTable()
+        for prefix in cidrs:
+            self.cidrs.add(prefix, prefix)
+        self.cidrs.build()
+        self.apps = frozenset(apps)
+        self.domains = DomainTrie(domains)
+
+        # One bit per port: 8 KiB covers the whole 16-bit range
+        self.ports = bytearray(65536 // 8)
+        for port in ports:
+            port = int(port)
+            if 0 <= port <= 65535:
+                self.ports[port >> 3] |= 1 << (port & 7)
+
+    # -------------------------------------------------
+    # Individual checks
+    # -------------------------------------------------
+
+    def is_ip_blocked(self, ip: str) -> bool:
+        return ip in self.ips
+
+    def match_cidr(self, ip: str) -> Optional[str]:
+        return self.cidrs.lookup(ip)
+
+    def is_port_blocked(self, port: int) -> bool:
+        return 0 <= port <= 65535 and bool(self.ports[port >> 3] & (1 << (port & 7)))
+
+    def is_app_blocked(self, app: str) -> bool:
+        return app in self.apps
+
+    def match_domain(self, domain: str) -> Optional[str]:
+        return self.domains.match(domain)
+
+    # -------------------------------------------------
+    # Combined check
+    # -------------------------------------------------
+
+    def check(
+        self,
+        src_ip: str,
+        dst_port: int,
+        app: str,
+        domain: str | None,
+        dst_ip: str | None = None,
+    ) -> Optional[BlockReasonSchema]:
+
+        if src_ip in self.ips:
+            return BlockReasonSchema(type=BlockType.IP, detail=src_ip, rule=src_ip)
+        if dst_ip and dst_ip in self.ips:
+            return BlockReasonSchema(type=BlockType.IP, detail=dst_ip, rule=dst_ip)
+
+        prefix = self.cidrs.lookup(src_ip)
+        if prefix:
+            return BlockReasonSchema(type=BlockType.CIDR, detail=src_ip, rule=prefix)
+        if dst_ip:
+            prefix = self.cidrs.lookup(dst_ip)
+            if prefix:
+                return BlockReasonSchema(type=BlockType.CIDR, detail=dst_ip, rule=prefix)
+
+        if self.is_port_blocked(dst_port):
+            return BlockReasonSchema(type=BlockType.PORT, detail=str(dst_port), rule=str(dst_port))
+
+        if app in self.apps:
+            return BlockReasonSchema(type=BlockType.APP, detail=app, rule=app)
+
+        if domain:
+            rule = self.domains.match(domain)
+            if rule:
+                return BlockReasonSchema(type=BlockType.DOMAIN, detail=domain, rule=rule)
+
+        return None
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from app.cache.redis import redis_client
+from app.schema.rule_schema import BlockReasonSchema, RuleHitSchema
+
+
+RULE_HITS_KEY = "rules:hits"
+RULE_BYTES_KEY = "rules:bytes"
+RULE_LAST_HIT_KEY = "rules:last_hit"
+
+
+def rule_key(reason: BlockReasonSchema) -> str:
+    """Hash field identifying a rule, e.g. "DOMAIN:*.example.com"."""
+    return f"{reason.type.value}:{reason.rule or reason.detail}"
+
+
+class RuleStatsService:
+    """
+    Per-rule hit and byte counters.
+
+    Drops are counted in a local dict and flushed to Redis hashes with
+    one pipelined HINCRBY batch per interval, so counting costs no Redis
+    traffic on the packet path. last_hit is the newest hit seen by the
+    process that flushed last, accurate to about one flush interval.
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+
+        # rule key -> [hits, bytes, last hit (epoch seconds)]
+        self._pending: Dict[str, List] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ==============================
+    # Lifecycle
+    # ==============================
+
+    async def start(self):
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Counters were merged back; retry on the next tick
+                pass
+
+    # ==============================
+    # Recording
+    # ==============================
+
+    def record(self, key: str, size: int):
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [1, size, time.time()]
+        else:
+            entry[0] += 1
+            entry[1] += size
+            entry[2] = time.time()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            pipe = redis_client().pipeline(transaction=False)
+            for key, (hits, size, _) in pending.items():
+                pipe.hincrby(RULE_HITS_KEY, key, hits)
+                pipe.hincrby(RULE_BYTES_KEY, key, size)
+            pipe.hset(RULE_LAST_HIT_KEY, mapping={
+                key: f"{last_hit:.3f}" for key, (_, _, last_hit) in pending.items()
+            })
+            await pipe.execute()
+
+        except Exception:
+            # Keep the counts for the next flush
+            for key, (hits, size, last_hit) in pending.items():
+                entry = self._pending.setdefault(key, [0, 0, last_hit])
+                entry[0] += hits
+                entry[1] += size
+                entry[2] = max(entry[2], last_hit)
+            raise
+
+    # ==============================
+    # Reporting
+    # ==============================
+
+    async def get_stats(
+        self,
+        limit: int = 100,
+        rule_keys: Optional[List[str]] = None,
+        ascending: bool = False,
+    ) -> List[RuleHitSchema]:
+        """
+        Rules sorted by hits (busiest first unless `ascending`). When
+        `rule_keys` lists every configured rule, rules that never fired
+        are included with zero hits so they can be pruned.
+        """
+        pipe = redis_client().pipeline(transaction=False)
+        pipe.hgetall(RULE_HITS_KEY)
+        pipe.hgetall(RULE_BYTES_KEY)
+        pipe.hgetall(RULE_LAST_HIT_KEY)
+        hits, sizes, last_hits = await pipe.execute()
+
+        keys = set(hits)
+        if rule_keys is not None:
+            keys.update(rule_keys)
+
+        rows = []
+        for key in keys:
+            rule_type, rule = key.split(":", 1)
+            last_hit = last_hits.get(key)
+            rows.append(RuleHitSchema(
+                type=rule_type,
+                rule=rule,
+                hits=int(hits.get(key, 0)),
+                bytes=int(sizes.get(key, 0)),
+                last_hit=(
+                    datetime.fromtimestamp(float(last_hit), timezone.utc)
+                    if last_hit else None
+                ),
+            ))
+
+        rows.sort(key=lambda r: (r.hits, r.bytes), reverse=not ascending)
+        return rows[:limit]
@@ -0,0 +1,86 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.schema.stats_schema import HeavyHitterSchema, TopTalkersSchema
+from app.utils.sketches import SpaceSaving
+
+
+DIMENSIONS = ("src_ips", "dst_ips", "domains", "flows")
+METRICS = ("bytes", "packets")
+
+# Counters per sketch. Estimates are high by at most total / capacity,
+# e.g. under 0.4% of all traffic with the default 256.
+DEFAULT_CAPACITY = 256
+
+# (src ip, src port, dst ip, dst port, protocol)
+FlowLabel = Tuple[str, int, str, int, str]
+
+
+def format_flow(flow: FlowLabel) -> str:
+    src_ip, src_port, dst_ip, dst_port, protocol = flow
+    return f"{src_ip}:{src_port} -> {dst_ip}:{dst_port}/{protocol}"
+
+
+class TopTalkers:
+    """
+    Heavy hitters by source IP, destination IP, domain and flow, each
+    ranked by bytes and by packets, in constant memory.
+
+    One Space-Saving sketch per (dimension, metric); see SpaceSaving for
+    the error bounds. Every worker keeps its own instance and merge()
+    combines them for reporting.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.sketches: Dict[Tuple[str, str], SpaceSaving] = {
+            (dimension, metric): SpaceSaving(capacity)
+            for dimension in DIMENSIONS
+            for metric in METRICS
+        }
+        self._bind()
+
+    def _bind(self):
+        # Direct references for the per-packet path
+        s = self.sketches
+        self._src = (s["src_ips", "bytes"], s["src_ips", "packets"])
+        self._dst = (s["dst_ips", "bytes"], s["dst_ips", "packets"])
+        self._domain = (s["domains", "bytes"], s["domains", "packets"])
+        self._flow = (s["flows", "bytes"], s["flows", "packets"])
+
+    def record(self, src_ip: str, dst_ip: str, flow: FlowLabel, size: int, domain: Optional[str] = None):
+        self._src[0].update(src_ip, size)
+        self._src[1].update(src_ip)
+        self._dst[0].update(dst_ip, size)
+        self._dst[1].update(dst_ip)
+        self._flow[0].update(flow, size)
+        self._flow[1].update(flow)
+        if domain:
+            self._domain[0].update(domain, size)
+            self._domain[1].update(domain)
+
+    @classmethod
+    def merge(cls, parts: Iterable["TopTalkers"], capacity: int = DEFAULT_CAPACITY) -> "TopTalkers":
+        parts = list(parts)
+        merged = cls(capacity)
+        for name in merged.sketches:
+            merged.sketches[name] = SpaceSaving.merge_all(
+                (part.sketches[name] for part in parts), capacity,
+            )
+        merged._bind()
+        return merged
+
+    def report(self, metric: str = "bytes", n: int = 10) -> TopTalkersSchema:
+        lists = {}
+        for dimension in DIMENSIONS:
+            lists[dimension] = [
+                HeavyHitterSchema(
+                    key=format_flow(key) if dimension == "flows" else key,
+                    estimate=estimate,
+                    max_error=error,
+                )
+                for key, estimate, error in self.sketches[dimension, metric].top(n)
+            ]
+        return TopTalkersSchema(**lists)
+
+    def report_all(self, n: int = 10) -> Dict[str, TopTalkersSchema]:
+        return {metric: self.report(metric, n) for metric in METRICS}
@@ -0,0 +1,388 @@
+import asyncio
+import multiprocessing
+import signal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.cache.redis import redis_manager
+from app.schema.dpi_config_schema import DPIConfig
+from app.schema.packet_schema import PacketSchema
+from app.services.cardinality_service import CardinalityStats
+from app.services.classification_service import ClassificationService, build_prefix_table
+from app.services.connection import FlowRecord, FlowTimeouts
+from app.services.fast_path import FastPathProcessor
+from app.services.flow_export_service import FlowExportService
+from app.services.packet_codec import (
+    PACKET_RECORD_SIZE,
+    VERDICT_RECORD_SIZE,
+    pack_packet_into,
+    pack_verdict_into,
+    unpack_packet,
+    unpack_verdict,
+)
+from app.services.rule_service import RuleService
+from app.utils.coarse_clock import clock
+from app.utils.shm_ring import ShmRing
+
+
+# Records taken from a ring per pass
+RING_BATCH = 256
+
+# Idle polling: yield first, then back off up to 2 ms
+_IDLE_SLEEPS = (0, 0, 0.0001, 0.0002, 0.0005, 0.001, 0.002)
+
+
+def _idle_sleep(idle: int) -> float:
+    return _IDLE_SLEEPS[min(idle, len(_IDLE_SLEEPS) - 1)]
+
+
+class ProcessWorker:
+    """
+    Parent-side handle for a FastPathProcessor running in its own OS
+    process.
+
+    Packets go to the child through a shared-memory SPSC ring of
+    fixed-layout records (see packet_codec) and verdicts come back
+    through a second ring, so the hot path has no pickling and no
+    syscalls. The child runs its own RuleService, which stays in sync
+    through the rule snapshot's Redis invalidation channel. Stats and
+    flow snapshots are fetched over a control pipe on request.
+
+    Exposes the same worker interface as FastPathProcessor.
+    """
+
+    def __init__(
+        self,
+        fp_id: int,
+        config: DPIConfig,
+        output_callback: Callable[[PacketSchema, str], None],
+        ring_slots: int = 65536,
+    ):
+        self.fp_id = fp_id
+        self.config = config
+        self.output_callback = output_callback
+        self.ring_slots = ring_slots
+
+        self._in: Optional[ShmRing] = None
+        self._out: Optional[ShmRing] = None
+        self._process = None
+        self._control = None
+        self._control_lock = asyncio.Lock()
+        self._reader: Optional[asyncio.Task] = None
+        # Set whenever verdicts come back: the child frees input slots first
+        self._room = asyncio.Event()
+
+        # In-flight packets and their futures by sequence number
+        self._pending: Dict[int, Tuple[PacketSchema, asyncio.Future]] = {}
+        self._seq = 0
+
+    # ==============================
+    # Lifecycle
+    # ==============================
+
+    async def start(self):
+        if self._process is not None:
+            return
+
+        ctx = multiprocessing.get_context("spawn")
+        self._in = ShmRing.create(self.ring_slots, PACKET_RECORD_SIZE)
+        self._out = ShmRing.create(self.ring_slots, VERDICT_RECORD_SIZE)
+
+        self._control, child_control = ctx.Pipe()
+        self._process = ctx.Process(
+            target=worker_main,
+            args=(
+                self.fp_id,
+                self.config.model_dump(),
+                self._in.name,
+                self._out.name,
+                self.ring_slots,
+                child_control,
+            ),
+            name=f"dpi-worker-{self.fp_id}",
+            daemon=True,
+        )
+        self._process.start()
+        child_control.close()
+
+        try:
+            status = await asyncio.to_thread(self._control.recv)
+        except EOFError:
+            status = ("error", f"exited with code {self._process.exitcode}")
+        if status[0] != "ready":
+            await self._cleanup()
+            raise RuntimeError(f"Worker {self.fp_id} failed to start: {status[1]}")
+
+        self._reader = asyncio.create_task(self._read_verdicts())
+
+    async def stop(self):
+        if self._process is None:
+            return
+
+        # The child drains its input ring before acknowledging
+        if self._process.is_alive():
+            try:
+                await self._request("stop")
+            except (EOFError, OSError):
+                pass
+        await asyncio.to_thread(self._process.join, 5)
+
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        await self._deliver_verdicts()
+
+        await self._cleanup()
+
+    async def _cleanup(self):
+        if self._process is not None and self._process.is_alive():
+            self._process.kill()
+        self._process = None
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+        for ring in (self._in, self._out):
+            if ring is not None:
+                ring.close()
+        self._in = self._out = None
+        self._room.set()
+        self._fail_pending(RuntimeError(f"Worker {self.fp_id} stopped"))
+
+    def _fail_pending(self, error: Exception):
+        for _, future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    # ==============================
+    # Packet path
+    # ==============================
+
+    def _running(self) -> bool:
+        # The reader stops for good once the child has exited
+        return self._in is not None and self._reader is not None and not self._reader.done()
+
+    def _not_running(self, future: Optional[asyncio.Future]) -> asyncio.Future:
+        future = future or asyncio.get_running_loop().create_future()
+        if not future.done():
+            future.set_exception(RuntimeError(f"Worker {self.fp_id} is not running"))
+        return future
+
+    def try_submit(self, packet: PacketSchema, future: Optional[asyncio.Future] = None) -> Optional[asyncio.Future]:
+        """
+        Enqueue a packet; the future (created unless one is passed in)
+        resolves to its verdict. None when the ring is full; an already
+        failed future when the worker is stopped or has exited.
+        """
+        if not self._running():
+            return self._not_running(future)
+
+        offset = self._in.reserve()
+        if offset is None:
+            return None
+
+        self._seq += 1
+        pack_packet_into(self._in.buf, offset, self._seq, packet)
+        self._in.commit()
+
+        future = future or asyncio.get_running_loop().create_future()
+        self._pending[self._seq] = (packet, future)
+        return future
+
+    async def submit(self, packet: PacketSchema, future: Optional[asyncio.Future] = None) -> Optional[asyncio.Future]:
+        """try_submit(), waiting for room instead of failing."""
+        while True:
+            result = self.try_submit(packet, future)
+            if result is not None:
+                return result
+            await self.wait_for_room()
+
+    async def wait_for_room(self):
+        """
+        Return once the input ring has a free slot, or the worker is gone
+        (try_submit() then fails packets at once rather than reporting a
+        full ring).
+        """
+        while self._running() and self._in.size() >= self._in.capacity:
+            self._room.clear()
+            await self._room.wait()
+
+    def queue_depth(self) -> int:
+        return self._in.size() if self._in else 0
+
+    def queue_capacity(self) -> int:
+        return self.ring_slots
+
+    async def _deliver_verdicts(self) -> int:
+        ring = self._out
+        offsets = ring.peek(RING_BATCH)
+        if not offsets:
+            return 0
+
+        verdicts = [unpack_verdict(ring.buf, offset) for offset in offsets]
+        ring.release(len(offsets))
+        self._room.set()
+
+        for seq, action in verdicts:
+            entry = self._pending.pop(seq, None)
+            if entry is None:
+                continue
+            packet, future = entry
+            if action == "ERROR":
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Worker {self.fp_id} failed to process packet"))
+                continue
+            await self.output_callback(packet, action)
+            if not future.done():
+                future.set_result(action)
+        return len(verdicts)
+
+    async def _read_verdicts(self):
+        idle = 0
+        while True:
+            if await self._deliver_verdicts():
+                idle = 0
+            else:
+                idle += 1
+                # Fully idle: make sure nobody waits on a dead worker
+                if idle >= len(_IDLE_SLEEPS) and not self._process.is_alive():
+                    self._fail_pending(RuntimeError(f"Worker {self.fp_id} exited"))
+                    self._room.set()
+                    return
+            await asyncio.sleep(_idle_sleep(idle))
+
+    # ==============================
+    # Control requests
+    # ==============================
+
+    async def _request(self, kind: str):
+        async with self._control_lock:
+            self._control.send(kind)
+            return await asyncio.to_thread(self._control.recv)
+
+    async def snapshot_connections(self) -> List[FlowRecord]:
+        return await self._request("connections")
+
+    async def get_state(self) -> dict:
+        state = await self._request("state")
+        state["cardinality"] = CardinalityStats.from_bytes(state["cardinality"])
+        return state
+
+
+# =================================================
+# Child process
+# =================================================
+
+def worker_main(fp_id: int, config_data: dict, in_name: str, out_name: str, ring_slots: int, control):
+    # Shutdown is driven by the parent over the control pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(fp_id, DPIConfig(**config_data), in_name, out_name, ring_slots, control))
+
+
+async def _discard_output(packet: PacketSchema, action: str):
+    pass
+
+
+def _worker_state(processor: FastPathProcessor) -> dict:
+    return {
+        "stats": dict(processor.stats),
+        "connections": processor.conn_tracker.get_stats(),
+        "top_talkers": processor.top_talkers,
+        "cardinality": processor.cardinality.to_bytes(),
+    }
+
+
+async def _worker_loop(fp_id: int, config: DPIConfig, in_name: str, out_name: str, ring_slots: int, control):
+    try:
+        await redis_manager.connect()
+    except Exception as e:
+        control.send(("error", str(e)))
+        return
+
+    await clock.start()
+
+    rule_service = RuleService()
+    await rule_service.start()
+
+    flow_exporter = FlowExportService.from_config(config, subdirectory=f"worker-{fp_id}")
+    if flow_exporter:
+        flow_exporter.start()
+
+    processor = FastPathProcessor(
+        fp_id=fp_id,
+        rule_service=rule_service,
+        output_callback=_discard_output,
+        classifier=ClassificationService(
+            build_prefix_table(config.app_prefixes_file)
+            if config.app_prefixes_file else None
+        ),
+        flow_timeouts=FlowTimeouts.from_config(config),
+        flow_exporter=flow_exporter,
+    )
+    await processor.start(consume=False)
+
+    in_ring = ShmRing.attach(in_name, ring_slots, PACKET_RECORD_SIZE)
+    out_ring = ShmRing.attach(out_name, ring_slots, VERDICT_RECORD_SIZE)
+
+    stopping = asyncio.Event()
+
+    def on_control():
+        kind = control.recv()
+        if kind == "state":
+            control.send(_worker_state(processor))
+        elif kind == "connections":
+            control.send(processor.conn_tracker.snapshot())
+        elif kind == "stop":
+            stopping.set()
+
+    loop = asyncio.get_running_loop()
+    loop.add_reader(control.fileno(), on_control)
+    control.send(("ready",))
+
+    idle = 0
+    while True:
+        offsets = in_ring.peek(RING_BATCH)
+        if not offsets:
+            if stopping.is_set():
+                break
+            idle += 1
+            await asyncio.sleep(_idle_sleep(idle))
+            continue
+        idle = 0
+
+        records = [unpack_packet(in_ring.buf, offset) for offset in offsets]
+        in_ring.release(len(offsets))
+
+        try:
+            results = await processor.process_batch([packet for _, packet in records])
+        except Exception as e:
+            # Packets may already be tracked; fail them rather than re-run
+            results = [e] * len(records)
+
+        for (seq, _), result in zip(records, results):
+            action = "ERROR" if isinstance(result, Exception) else result
+            # Backpressure from the parent's verdict reader
+            out_offset = out_ring.reserve()
+            while out_offset is None:
+                await asyncio.sleep(_idle_sleep(2))
+                out_offset = out_ring.reserve()
+            pack_verdict_into(out_ring.buf, out_offset, seq, action)
+            out_ring.commit()
+
+        await asyncio.sleep(0)
+
+    loop.remove_reader(control.fileno())
+
+    await processor.stop()
+    await rule_service.stop()
+    if flow_exporter:
+        await flow_exporter.stop()
+    await clock.stop()
+    await redis_manager.disconnect()
+
+    in_ring.close()
+    out_ring.close()
+    control.send("stopped")
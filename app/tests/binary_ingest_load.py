@@ -0,0 +1,107 @@
+import asyncio
+import sys
+import time
+
+from app.schema.connection_schema import FiveTupleSchema, Protocol
+from app.schema.packet_schema import PacketSchema
+from app.services.packet_codec import (
+    WIRE_DROPPED,
+    WIRE_FORWARDED,
+    WIRE_INVALID,
+    encode_wire_frame,
+)
+
+
+# Usage: python -m app.tests.binary_ingest_load [host] [port] [packets] [connections]
+# e.g.   python -m app.tests.binary_ingest_load 127.0.0.1 9099 1000000 4
+# Needs the server running with DPIConfig(binary_ingest_port=9099).
+DEFAULT_PACKETS = 200_000
+DEFAULT_CONNECTIONS = 2
+
+# Frames written per send, and records a connection keeps unanswered
+SEND_CHUNK = 1000
+WINDOW = 20_000
+
+DOMAINS = ["www.youtube.com", "www.google.com", "api.github.com", None]
+
+
+def make_packet(i: int) -> PacketSchema:
+    # Skip validation: the client measures the listener, not pydantic
+    return PacketSchema.model_construct(
+        tuple=FiveTupleSchema.model_construct(
+            src_ip=f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+            dst_ip="142.250.1.1",
+            src_port=1024 + (i % 60000),
+            dst_port=443,
+            protocol=Protocol.TCP,
+        ),
+        size=64 + i % 1400,
+        outbound=True,
+        tcp_flags=0,
+        domain=DOMAINS[i % len(DOMAINS)],
+    )
+
+
+async def run_connection(host: str, port: int, frames: list, counts: list):
+    reader, writer = await asyncio.open_connection(host, port)
+    total = len(frames)
+    received = 0
+    window_open = asyncio.Event()
+    window_open.set()
+
+    async def receive():
+        nonlocal received
+        while received < total:
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            for code in (WIRE_FORWARDED, WIRE_DROPPED, WIRE_INVALID):
+                counts[code] += data.count(code)
+            received += len(data)
+            window_open.set()
+
+    receiver = asyncio.create_task(receive())
+
+    for start in range(0, total, SEND_CHUNK):
+        while start - received > WINDOW:
+            window_open.clear()
+            await window_open.wait()
+        writer.write(b"".join(frames[start:start + SEND_CHUNK]))
+        await writer.drain()
+
+    await receiver
+    writer.close()
+
+
+async def main():
+    host = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 9099
+    packets = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_PACKETS
+    connections = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_CONNECTIONS
+
+    per_connection = packets // connections
+    batches = [
+        [encode_wire_frame(make_packet(c * per_connection + i)) for i in range(per_connection)]
+        for c in range(connections)
+    ]
+    counts = [0, 0, 0]
+
+    print("====================================")
+    print("  Binary ingest load test")
+    print("====================================")
+    print(f"Target:      {host}:{port}")
+    print(f"Packets:     {per_connection * connections} over {connections} connection(s)")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(host, port, frames, counts) for frames in batches))
+    elapsed = time.perf_counter() - start
+
+    print(f"Elapsed:     {elapsed:.2f}s")
+    print(f"Throughput:  {per_connection * connections / elapsed:,.0f} pps")
+    print(f"Forwarded:   {counts[WIRE_FORWARDED]}")
+    print(f"Dropped:     {counts[WIRE_DROPPED]}")
+    print(f"Invalid:     {counts[WIRE_INVALID]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+import sys
+import time
+
+from app.schema.connection_schema import FiveTupleSchema, Protocol
+from app.services.connection import ConnectionTracker
+
+
+# Usage: python -m app.tests.connection_benchmark [table_size ...]
+# e.g.   python -m app.tests.connection_benchmark 10000 100000 1000000 10000000
+# (10M flows needs several GB of RAM)
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+MEASURED_INSERTS = 50_000
+
+
+def make_tuple(i: int) -> FiveTupleSchema:
+    # Skip validation: the benchmark measures the tracker, not pydantic
+    return FiveTupleSchema.model_construct(
+        src_ip=f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+        dst_ip=f"172.16.{(i >> 24) & 255}.1",
+        src_port=1024 + (i % 60000),
+        dst_port=443,
+        protocol=Protocol.TCP,
+    )
+
+
+def run(size: int) -> float:
+    tracker = ConnectionTracker(fp_id=0, max_connections=size)
+
+    # Fill the table to capacity
+    for i in range(size):
+        tracker.get_or_create(make_tuple(i))
+
+    # Every further insert now evicts the least recently seen flow
+    tuples = [make_tuple(size + i) for i in range(MEASURED_INSERTS)]
+
+    start = time.perf_counter()
+    for t in tuples:
+        tracker.get_or_create(t)
+    elapsed = time.perf_counter() - start
+
+    return elapsed / MEASURED_INSERTS * 1e6
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or DEFAULT_SIZES
+
+    print("====================================")
+    print("  ConnectionTracker insert benchmark")
+    print("====================================")
+    print(f"{'flows':>12} {'us/insert (full table)':>24}")
+
+    for size in sizes:
+        per_insert = run(size)
+        print(f"{size:>12,} {per_insert:>24.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class CoarseClock:
+    """
+    Monotonic clock refreshed once per tick by a background task.
+
+    Hot paths read the `now` attribute instead of calling into the OS for
+    every packet; resolution is one tick. to_datetime() converts a reading
+    back to wall-clock time for reporting, to_epoch() to Unix seconds.
+    """
+
+    def __init__(self, tick: float = 0.1):
+        self.tick = tick
+        self.now = time.monotonic()
+        self._wall_offset = time.time() - self.now
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self) -> float:
+        self.now = time.monotonic()
+        self._wall_offset = time.time() - self.now
+        return self.now
+
+    def to_epoch(self, reading: float) -> float:
+        return reading + self._wall_offset
+
+    def to_datetime(self, reading: float) -> datetime:
+        return datetime.fromtimestamp(self.to_epoch(reading), timezone.utc)
+
+    async def start(self):
+        self.refresh()
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.refresh()
+
+
+# Process-wide clock shared by every flow table
+clock = CoarseClock()
@@ -0,0 +1,75 @@
+from typing import Dict, Iterable, List, Optional
+
+# Marker keys stored next to the label children of a node. Neither can
+# appear inside a DNS label.
+_EXACT = "\x00"
+_WILDCARD = "\x01"
+
+
+def _labels(domain: str) -> List[str]:
+    return domain.strip().lower().rstrip(".").split(".")
+
+
+def domain_candidates(domain: str) -> List[str]:
+    """
+    Every rule string that could match `domain`, most specific first:
+    the domain itself, then "*." + each parent suffix.
+    "a.b.example.com" -> ["a.b.example.com", "*.b.example.com",
+    "*.example.com", "*.com"]
+    """
+    labels = _labels(domain)
+    candidates = [".".join(labels)]
+    for i in range(1, len(labels)):
+        candidates.append("*." + ".".join(labels[i:]))
+    return candidates
+
+
+class DomainTrie:
+    """
+    Reversed-label trie for domain rules.
+
+    Exact rules ("example.com") match only that name; wildcard rules
+    ("*.example.com") match any name strictly below the suffix. A lookup
+    walks the labels right to left once, so it costs O(number of labels)
+    regardless of how many rules are loaded, and it returns the rule that
+    matched (exact first, otherwise the deepest wildcard).
+    """
+
+    def __init__(self, rules: Iterable[str] = ()):
+        self._root: Dict[str, dict] = {}
+        self._size = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: str):
+        rule = rule.strip().lower()
+        wildcard = rule.startswith("*.")
+        labels = _labels(rule[2:] if wildcard else rule)
+
+        node = self._root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+
+        marker = _WILDCARD if wildcard else _EXACT
+        if marker not in node:
+            self._size += 1
+        node[marker] = rule
+
+    def match(self, domain: str) -> Optional[str]:
+        labels = _labels(domain)
+
+        node = self._root
+        wildcard = None
+
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return wildcard
+            # A wildcard only covers names with labels left to the left
+            if i > 0 and _WILDCARD in node:
+                wildcard = node[_WILDCARD]
+
+        return node.get(_EXACT) or wildcard
+
+    def __len__(self) -> int:
+        return self._size
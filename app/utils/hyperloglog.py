@@ -0,0 +1,83 @@
+import math
+from hashlib import blake2b
+from typing import Iterable, Union
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter (Flajolet et al., with the small-range
+    linear-counting correction).
+
+    2**p one-byte registers; add() is O(1) and memory is fixed. The
+    relative standard error is about 1.04 / sqrt(2**p): 1.6% at p=12
+    (4 KiB), 3.3% at p=10 (1 KiB). Counters with the same precision
+    merge by taking the register-wise maximum, and serialize to
+    1 + 2**p bytes, so per-worker or per-process counters combine
+    exactly as if they had seen the union of the inputs.
+    """
+
+    __slots__ = ("p", "m", "registers", "_rank_bits")
+
+    def __init__(self, p: int = 12):
+        if not 4 <= p <= 16:
+            raise ValueError(f"HyperLogLog precision must be 4..16, got {p}")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self._rank_bits = 64 - p
+
+    def add(self, value: Union[str, bytes]):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        x = int.from_bytes(blake2b(value, digest_size=8).digest(), "big")
+
+        index = x >> self._rank_bits
+        rest = x & ((1 << self._rank_bits) - 1)
+        rank = self._rank_bits - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        if estimate <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Fold `other` into this counter in place and return it."""
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog counters of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @classmethod
+    def union(cls, counters: Iterable["HyperLogLog"], p: int = 12) -> "HyperLogLog":
+        result = cls(p)
+        for counter in counters:
+            result.merge(counter)
+        return result
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.p]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        counter = cls(data[0])
+        if len(data) != 1 + counter.m:
+            raise ValueError("Truncated HyperLogLog data")
+        counter.registers = bytearray(data[1:])
+        return counter
+
+    def __len__(self) -> int:
+        return self.count()
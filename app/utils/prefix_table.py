@@ -0,0 +1,121 @@
+import socket
+from bisect import bisect_right
+import ipaddress
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def ip_to_int(ip: str) -> Optional[Tuple[int, int]]:
+    """
+    Convert a textual IPv4/IPv6 address to (version, integer).
+    Returns None for anything that is not a valid address.
+    """
+    try:
+        if ":" in ip:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+class PrefixTable(Generic[T]):
+    """
+    Sorted interval table over integer IPv4 and IPv6 addresses.
+
+    Prefixes are collected with add() and flattened by build() into
+    non-overlapping [start, end] ranges, so nested prefixes resolve to
+    the most specific one (longest-prefix match) and every lookup is a
+    single bisect.
+    """
+
+    def __init__(self):
+        self._pending: Dict[int, List[Tuple[int, int, int, T]]] = {4: [], 6: []}
+        self._starts: Dict[int, List[int]] = {4: [], 6: []}
+        self._ends: Dict[int, List[int]] = {4: [], 6: []}
+        self._values: Dict[int, List[T]] = {4: [], 6: []}
+
+    # -------------------------------------------------
+    # Building
+    # -------------------------------------------------
+
+    def add(self, prefix: str, value: T):
+        net = ipaddress.ip_network(prefix.strip(), strict=False)
+        self._pending[net.version].append((
+            int(net.network_address),
+            int(net.broadcast_address),
+            net.prefixlen,
+            value,
+        ))
+
+    def build(self) -> "PrefixTable[T]":
+        for version, entries in self._pending.items():
+            starts, ends, values = self._flatten(entries)
+            self._starts[version] = starts
+            self._ends[version] = ends
+            self._values[version] = values
+        return self
+
+    @staticmethod
+    def _flatten(entries: List[Tuple[int, int, int, T]]):
+        # Outer prefixes sort before the prefixes nested inside them,
+        # so a stack of open ranges is enough to split them apart.
+        entries = sorted(entries, key=lambda e: (e[0], e[2]))
+
+        starts: List[int] = []
+        ends: List[int] = []
+        values: List[T] = []
+
+        def emit(lo: int, hi: int, value: T):
+            if lo > hi:
+                return
+            if ends and ends[-1] + 1 == lo and values[-1] == value:
+                ends[-1] = hi
+                return
+            starts.append(lo)
+            ends.append(hi)
+            values.append(value)
+
+        stack: List[Tuple[int, T]] = []
+        cursor = 0
+
+        for start, end, _, value in entries:
+            while stack and stack[-1][0] < start:
+                top_end, top_value = stack.pop()
+                emit(cursor, top_end, top_value)
+                cursor = top_end + 1
+
+            if stack:
+                emit(cursor, start - 1, stack[-1][1])
+
+            stack.append((end, value))
+            cursor = start
+
+        while stack:
+            top_end, top_value = stack.pop()
+            emit(cursor, top_end, top_value)
+            cursor = top_end + 1
+
+        return starts, ends, values
+
+    # -------------------------------------------------
+    # Lookup
+    # -------------------------------------------------
+
+    def lookup(self, ip: str) -> Optional[T]:
+        parsed = ip_to_int(ip)
+        if parsed is None:
+            return None
+        return self.lookup_int(*parsed)
+
+    def lookup_int(self, version: int, address: int) -> Optional[T]:
+        starts = self._starts[version]
+        i = bisect_right(starts, address) - 1
+
+        if i >= 0 and address <= self._ends[version][i]:
+            return self._values[version][i]
+
+        return None
+
+    def __len__(self) -> int:
+        return len(self._starts[4]) + len(self._starts[6])
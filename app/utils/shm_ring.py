@@ -0,0 +1,117 @@
+import struct
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+
+# Head (consumer) and tail (producer) counters live on separate cache lines
+_HEAD_OFFSET = 0
+_TAIL_OFFSET = 64
+_HEADER_SIZE = 128
+
+_COUNTER = struct.Struct("<Q")
+
+
+class ShmRing:
+    """
+    Single-producer / single-consumer ring of fixed-size records in a
+    multiprocessing.shared_memory block.
+
+    Layout: a 128-byte header holding the consumer's head and the
+    producer's tail as free-running u64 counters, then `capacity` slots
+    of `record_size` bytes. Each side only writes its own counter and
+    publishes it after the slot contents, so no lock is needed with one
+    producer and one consumer (aligned 8-byte stores are not torn on the
+    platforms CPython targets).
+
+    Records are written and read in place: the producer reserve()s a
+    slot offset, packs into `buf`, then commit()s; the consumer takes
+    offsets from peek() and release()s them when done.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, capacity: int, record_size: int, owner: bool):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = capacity
+        self.record_size = record_size
+        self._owner = owner
+
+        # Each side caches its own counter
+        self._head = _COUNTER.unpack_from(self.buf, _HEAD_OFFSET)[0]
+        self._tail = _COUNTER.unpack_from(self.buf, _TAIL_OFFSET)[0]
+
+    @classmethod
+    def create(cls, capacity: int, record_size: int) -> "ShmRing":
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + capacity * record_size)
+        shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        return cls(shm, capacity, record_size, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, capacity: int, record_size: int) -> "ShmRing":
+        """
+        Open a ring created by the parent process. Children started by
+        multiprocessing share the parent's resource tracker, so the block
+        is still unlinked exactly once, by the creator.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, capacity, record_size, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    # ==============================
+    # Producer side
+    # ==============================
+
+    def reserve(self) -> Optional[int]:
+        """Offset of the next free slot, or None when the ring is full."""
+        head = _COUNTER.unpack_from(self.buf, _HEAD_OFFSET)[0]
+        if self._tail - head >= self.capacity:
+            return None
+        return _HEADER_SIZE + (self._tail % self.capacity) * self.record_size
+
+    def commit(self):
+        self._tail += 1
+        _COUNTER.pack_into(self.buf, _TAIL_OFFSET, self._tail)
+
+    def try_push(self, record: bytes) -> bool:
+        offset = self.reserve()
+        if offset is None:
+            return False
+        self.buf[offset:offset + len(record)] = record
+        self.commit()
+        return True
+
+    # ==============================
+    # Consumer side
+    # ==============================
+
+    def peek(self, max_n: int) -> List[int]:
+        """Offsets of up to `max_n` readable slots, oldest first."""
+        tail = _COUNTER.unpack_from(self.buf, _TAIL_OFFSET)[0]
+        n = min(tail - self._head, max_n)
+        capacity = self.capacity
+        size = self.record_size
+        return [
+            _HEADER_SIZE + ((self._head + i) % capacity) * size
+            for i in range(n)
+        ]
+
+    def release(self, n: int):
+        self._head += n
+        _COUNTER.pack_into(self.buf, _HEAD_OFFSET, self._head)
+
+    # ==============================
+    # Either side
+    # ==============================
+
+    def size(self) -> int:
+        head = _COUNTER.unpack_from(self.buf, _HEAD_OFFSET)[0]
+        tail = _COUNTER.unpack_from(self.buf, _TAIL_OFFSET)[0]
+        return tail - head
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
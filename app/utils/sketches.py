@@ -0,0 +1,113 @@
+import heapq
+from typing import Dict, Generic, Hashable, Iterable, List, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class SpaceSaving(Generic[K]):
+    """
+    Weighted Space-Saving heavy-hitter summary (Metwally et al.).
+
+    Keeps at most `capacity` counters. An unseen key takes over the
+    smallest counter and inherits its count as error, so for every
+    tracked key:
+
+        estimate - error <= true weight <= estimate
+        error <= N / capacity
+
+    where N is the total weight added. Any key whose true weight exceeds
+    N / capacity is guaranteed to be tracked. Memory is O(capacity);
+    updating a tracked key is O(1), replacing one O(log capacity)
+    amortized.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.total = 0
+
+        # key -> [estimate, error]
+        self._counters: Dict[K, List[int]] = {}
+        # (estimate when pushed, key). Estimates only grow, so an entry
+        # can be stale-low but never too high; stale ones are refreshed
+        # when they reach the top.
+        self._heap: List[Tuple[int, K]] = []
+
+    def update(self, key: K, weight: int = 1):
+        self.total += weight
+
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            return
+
+        if len(self._counters) < self.capacity:
+            self._counters[key] = [weight, 0]
+            heapq.heappush(self._heap, (weight, key))
+            return
+
+        floor, victim = self._pop_min()
+        del self._counters[victim]
+        self._counters[key] = [floor + weight, floor]
+        heapq.heappush(self._heap, (floor + weight, key))
+
+    def _pop_min(self) -> Tuple[int, K]:
+        heap = self._heap
+        while True:
+            estimate, key = heapq.heappop(heap)
+            counter = self._counters.get(key)
+            if counter is None:
+                continue
+            if counter[0] == estimate:
+                return estimate, key
+            heapq.heappush(heap, (counter[0], key))
+
+    def min_estimate(self) -> int:
+        """Upper bound on the weight of any key that is not tracked."""
+        if len(self._counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self._counters.values())
+
+    def top(self, n: int = 10) -> List[Tuple[K, int, int]]:
+        """The `n` heaviest keys as (key, estimate, max overestimate)."""
+        items = heapq.nlargest(n, self._counters.items(), key=lambda item: item[1][0])
+        return [(key, estimate, error) for key, (estimate, error) in items]
+
+    def merge(self, other: "SpaceSaving[K]") -> "SpaceSaving[K]":
+        """
+        Combine two summaries into a new one (Agarwal et al., mergeable
+        summaries). A key missing from a full summary may still have up
+        to that summary's minimum there, which is added to its estimate
+        and error; the error bound then holds over the combined stream.
+        """
+        merged: SpaceSaving[K] = SpaceSaving(max(self.capacity, other.capacity))
+        merged.total = self.total + other.total
+
+        floor_a = self.min_estimate()
+        floor_b = other.min_estimate()
+
+        combined: Dict[K, List[int]] = {}
+        for key in self._counters.keys() | other._counters.keys():
+            a = self._counters.get(key, (floor_a, floor_a))
+            b = other._counters.get(key, (floor_b, floor_b))
+            combined[key] = [a[0] + b[0], a[1] + b[1]]
+
+        kept = heapq.nlargest(merged.capacity, combined.items(), key=lambda item: item[1][0])
+        merged._counters = dict(kept)
+        merged._heap = [(counter[0], key) for key, counter in kept]
+        heapq.heapify(merged._heap)
+        return merged
+
+    @classmethod
+    def merge_all(cls, sketches: Iterable["SpaceSaving[K]"], capacity: int = 256) -> "SpaceSaving[K]":
+        result: SpaceSaving[K] = cls(capacity)
+        for sketch in sketches:
+            result = result.merge(sketch)
+        return result
+
+    def clear(self):
+        self.total = 0
+        self._counters.clear()
+        self._heap.clear()
+
+    def __len__(self) -> int:
+        return len(self._counters)
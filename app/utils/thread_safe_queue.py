@@ -1,5 +1,6 @@
 import asyncio
-from typing import Generic, TypeVar, Optional
+from collections import deque
+from typing import Deque, Generic, List, TypeVar, Optional
 
 T = TypeVar("T")
 
@@ -7,46 +8,94 @@ T = TypeVar("T")
 class AsyncQueue(Generic[T]):
     """
     Async-safe bounded queue with graceful shutdown and back-pressure support.
+
+    Consumers wait on an event rather than a timer: pop_many() takes
+    everything available (up to a limit) after a single await, and
+    shutdown() wakes any waiting consumer at once. After shutdown, pops
+    drain what is left and then return empty.
+
+    As with asyncio.Queue, a max_size of 0 or less means unbounded.
     """
 
     def __init__(self, max_size: int = 10000):
-        self._queue = asyncio.Queue(maxsize=max_size)
+        self._items: Deque[T] = deque()
+        self._max_size = max_size
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
         self._shutdown = False
 
-    async def push(self, item: T):
+    async def push(self, item: T) -> bool:
+        """Wait for room; False if the queue is shut down instead."""
+        await self.wait_not_full()
         if self._shutdown:
-            return
-        await self._queue.put(item)
+            return False
+        self._items.append(item)
+        self._not_empty.set()
+        return True
 
     def try_push(self, item: T) -> bool:
-        if self._shutdown:
-            return False
-        try:
-            self._queue.put_nowait(item)
-            return True
-        except asyncio.QueueFull:
+        if self._shutdown or self._full():
             return False
+        self._items.append(item)
+        self._not_empty.set()
+        return True
+
+    def _full(self) -> bool:
+        return 0 < self._max_size <= len(self._items)
+
+    async def wait_not_full(self):
+        """Return once there is room, or the queue is shut down."""
+        while not self._shutdown and self._full():
+            self._not_full.clear()
+            await self._not_full.wait()
+
+    async def _wait_not_empty(self) -> bool:
+        """False once the queue is shut down and drained."""
+        while not self._items:
+            if self._shutdown:
+                return False
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return True
 
     async def pop(self) -> Optional[T]:
-        if self._shutdown and self._queue.empty():
+        if not await self._wait_not_empty():
             return None
-        item = await self._queue.get()
+        item = self._items.popleft()
+        self._not_full.set()
         return item
 
+    async def pop_many(self, max_n: int) -> List[T]:
+        """Up to `max_n` items, waiting only while the queue is empty."""
+        if not await self._wait_not_empty():
+            return []
+        items = self._items
+        batch = [items.popleft() for _ in range(min(max_n, len(items)))]
+        self._not_full.set()
+        return batch
+
     async def pop_with_timeout(self, timeout: float) -> Optional[T]:
         try:
-            return await asyncio.wait_for(self._queue.get(), timeout)
+            return await asyncio.wait_for(self.pop(), timeout)
         except asyncio.TimeoutError:
             return None
 
     def empty(self) -> bool:
-        return self._queue.empty()
+        return not self._items
 
     def size(self) -> int:
-        return self._queue.qsize()
+        return len(self._items)
+
+    def capacity(self) -> int:
+        """max_size as given; 0 or less when unbounded."""
+        return self._max_size
 
     def shutdown(self):
         self._shutdown = True
+        # Wake consumers so they drain and exit, and blocked producers
+        self._not_empty.set()
+        self._not_full.set()
 
     def is_shutdown(self) -> bool:
         return self._shutdown
@@ -0,0 +1,192 @@
+import math
+from typing import Dict, Generic, Hashable, List, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class TimingWheel(Generic[K]):
+    """
+    Hashed timing wheel.
+
+    Deadlines are bucketed into `num_slots` slots of `tick` seconds by
+    their absolute tick number, so schedule and cancel are O(1) and each
+    advance only visits the slots that elapsed. Entries that wrap around
+    the wheel stay in their slot until their tick number is reached.
+    """
+
+    def __init__(self, tick: float = 1.0, num_slots: int = 512, now: float = 0.0):
+        self.tick = tick
+        self.num_slots = num_slots
+
+        self._slots: List[Dict[K, int]] = [{} for _ in range(num_slots)]
+        self._where: Dict[K, int] = {}
+        self._current = int(now // tick)
+
+    def _tick_of(self, deadline: float) -> int:
+        return max(math.ceil(deadline / self.tick), self._current + 1)
+
+    def schedule(self, key: K, deadline: float):
+        self.cancel(key)
+
+        at = self._tick_of(deadline)
+        slot = at % self.num_slots
+        self._slots[slot][key] = at
+        self._where[key] = slot
+
+    def cancel(self, key: K) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        self._slots[slot].pop(key, None)
+        return True
+
+    def advance(self, now: float) -> List[K]:
+        """
+        Move the wheel to `now` and return every key whose deadline has
+        passed, in no particular order.
+        """
+        target = int(now // self.tick)
+        if target <= self._current:
+            return []
+
+        expired: List[K] = []
+        # A gap longer than one revolution only needs one pass per slot
+        steps = min(target - self._current, self.num_slots)
+
+        for step in range(1, steps + 1):
+            slot = self._slots[(self._current + step) % self.num_slots]
+            due = [key for key, at in slot.items() if at <= target]
+            for key in due:
+                del slot[key]
+                del self._where[key]
+                expired.append(key)
+
+        self._current = target
+        return expired
+
+    def clear(self):
+        for slot in self._slots:
+            slot.clear()
+        self._where.clear()
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._where
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+
+class HierarchicalTimingWheel(Generic[K]):
+    """
+    Multi-level hashed timing wheel.
+
+    Level 0 has `slots` slots of one tick each; every level above covers
+    `slots` times the span of the one below, so a few levels reach far
+    deadlines without a huge slot array. schedule and cancel are O(1);
+    when a lower level wraps, the matching slot of the level above is
+    cascaded down, so every entry is moved at most once per level.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, now: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+
+        self._wheels: List[List[Dict[K, int]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        self._where: Dict[K, Tuple[int, int]] = {}
+        self._current = int(now // tick)
+        self._span = slots ** levels
+
+    def _place(self, key: K, at: int):
+        delta = at - self._current
+
+        level = 0
+        width = 1
+        while level < self.levels - 1 and delta >= width * self.slots:
+            level += 1
+            width *= self.slots
+
+        # Beyond the top level: parked there and re-placed on cascade
+        slot = (at // width) % self.slots
+        self._wheels[level][slot][key] = at
+        self._where[key] = (level, slot)
+
+    def schedule(self, key: K, deadline: float):
+        self.cancel(key)
+        self._place(key, max(math.ceil(deadline / self.tick), self._current + 1))
+
+    def cancel(self, key: K) -> bool:
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, slot = where
+        self._wheels[level][slot].pop(key, None)
+        return True
+
+    def _release(self, entries: Dict[K, int], expired: List[K]):
+        for key, at in entries.items():
+            if at <= self._current:
+                del self._where[key]
+                expired.append(key)
+            else:
+                self._place(key, at)
+
+    def advance(self, now: float) -> List[K]:
+        """
+        Move the wheel to `now` and return every key whose deadline has
+        passed, in no particular order.
+        """
+        target = int(now // self.tick)
+        if target <= self._current:
+            return []
+
+        expired: List[K] = []
+
+        if target - self._current >= self._span:
+            # Slept through a whole top-level revolution: re-sort everything
+            self._current = target
+            entries: Dict[K, int] = {}
+            for wheel in self._wheels:
+                for slot in wheel:
+                    entries.update(slot)
+                    slot.clear()
+            self._release(entries, expired)
+            return expired
+
+        while self._current < target:
+            self._current += 1
+            t = self._current
+
+            # Cascade every level that wrapped on this tick, highest first
+            wrapped = []
+            width = self.slots
+            while len(wrapped) < self.levels - 1 and t % width == 0:
+                wrapped.append((len(wrapped) + 1, (t // width) % self.slots))
+                width *= self.slots
+
+            for level, index in reversed(wrapped):
+                entries = self._wheels[level][index]
+                if entries:
+                    self._wheels[level][index] = {}
+                    self._release(entries, expired)
+
+            slot = self._wheels[0][t % self.slots]
+            if slot:
+                self._wheels[0][t % self.slots] = {}
+                self._release(slot, expired)
+
+        return expired
+
+    def clear(self):
+        for wheel in self._wheels:
+            for slot in wheel:
+                slot.clear()
+        self._where.clear()
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._where
+
+    def __len__(self) -> int:
+        return len(self._where)